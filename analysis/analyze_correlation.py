@@ -7,7 +7,9 @@
 #        Logic unchanged; only output filenames generalized.
 # Inputs: Update raster_dict paths to your own project data before running.
 # Outputs: correlation_matrix.csv, global_stats.csv, global_stats_full.csv,
-#          correlation_heatmap.png, high_corr_pairs.csv (if any).
+#          correlation_heatmap.png, high_corr_pairs.csv (if any),
+#          corr_cache_<hash>.npz (accumulated statistics reused on reruns, if use_stats_cache),
+#          Parquet copies of the three stats/correlation tables (if pyarrow is available).
 # Citation: Robillard (2025). *MGISA landform mapping scripts* [Computer software]. GitHub.
 # ---------------------------------------------------------------------
 
@@ -15,8 +17,12 @@ import arcpy
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import seaborn as sns
 import os
+import sys
+
+# Shared helpers (common/) live one folder up from this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.raster_cache import cache_path as stats_cache_path, raster_signature
 
 # Allow overwriting of outputs
 arcpy.env.overwriteOutput = True
@@ -30,6 +36,13 @@ arcpy.env.overwriteOutput = True
 output_dir = r"C:\path\to\outputs"
 os.makedirs(output_dir, exist_ok=True)
 
+# Optional statistics cache (off by default). When on, the streamed statistics are saved
+# as corr_cache_<hash>.npz and reused on reruns with unchanged inputs. FGDB rasters are
+# only partly checked for changes (grid properties + sampled windows), so change
+# stats_cache_tag (any text, e.g. a date) whenever an input raster is regenerated.
+use_stats_cache = False
+stats_cache_tag = ""
+
 # ---------------------------------------------------------------------
 # STEP 1: DEFINE INPUT RASTERS
 # ---------------------------------------------------------------------
@@ -47,41 +60,212 @@ raster_dict = {
 }
 
 # ---------------------------------------------------------------------
-# STEP 2: LOAD EACH RASTER INTO A NUMPY ARRAY
+# STEP 2: OPEN EACH RASTER AND DEFINE THE SHARED PROCESSING GRID
 # ---------------------------------------------------------------------
-# We use RasterToNumPyArray() to convert rasters into arrays.
-# This enables pixel-wise statistical comparisons and is the foundation
-# for stacking multiple layers for correlation analysis.
-# NoData values are converted to NaN for clean handling.
+# Rasters are streamed block-by-block with RasterToNumPyArray() instead of
+# being loaded whole, so peak memory is bounded by the block size rather
+# than by the size of the DEM. Only raster properties are read here.
+# If extents differ slightly, the grid is cropped to the smallest shared number
+# of rows and columns (anchored at the upper-left corner) to ensure proper stacking.
+
+rasters = {name: arcpy.Raster(path) for name, path in raster_dict.items()}
+names = list(rasters)
+k = len(names)
+
+min_rows = min(r.height for r in rasters.values())
+min_cols = min(r.width for r in rasters.values())
+
+block_size = (2048, 2048)  # (rows, cols) per block; lower this if memory is tight
 
-arrays = {}
-for name, path in raster_dict.items():
-    print(f"Loading raster: {name}")
-    arr = arcpy.RasterToNumPyArray(path, nodata_to_value=np.nan).astype(np.float32)
-    arrays[name] = arr
+
+def tile_iter(n_rows, n_cols, block=block_size):
+    """Yield (row_off, col_off, n_block_rows, n_block_cols) covering the shared grid."""
+    for r0 in range(0, n_rows, block[0]):
+        for c0 in range(0, n_cols, block[1]):
+            yield r0, c0, min(block[0], n_rows - r0), min(block[1], n_cols - c0)
+
+
+def read_block(raster, r0, c0, bh, bw):
+    """Read one block (offsets counted from the raster's upper-left cell) as float32."""
+    lower_left = arcpy.Point(raster.extent.XMin + c0 * raster.meanCellWidth,
+                             raster.extent.YMax - (r0 + bh) * raster.meanCellHeight)
+    arr = arcpy.RasterToNumPyArray(raster, lower_left, bw, bh, nodata_to_value=np.nan)
+    # Most derived rasters (Slope, TPI, SRI, Curvature) are already 32-bit float;
+    # only rasters stored in another pixel type are converted.
+    return arr.astype(np.float32, copy=False)
 
 # ---------------------------------------------------------------------
-# STEP 3: ALIGN ALL ARRAYS TO THE SHARED SPATIAL EXTENT
+# STEP 3: STREAM BLOCKS AND ACCUMULATE STATISTICS
 # ---------------------------------------------------------------------
-# If extents differ slightly, this crops each array to the smallest shared number of 
-# rows and columns to ensure proper stacking.
+# For each block, pixel values from all rasters are stacked into an (n, k) float32 matrix.
+# Rows with any NaN (NoData) are dropped to avoid bias in correlation analysis.
+# Each block is reduced to its valid-pixel count, mean, min, max and co-moment matrix
+# (sum of cross-products of deviations from the mean). Block results are merged into
+# running totals (Welford/Chan update), which stays numerically stable even for large
+# values such as elevation.
+#
+# If Numba is installed, the reduction runs as a compiled multi-threaded kernel that
+# tests NoData and accumulates in place, without gathering the valid rows into a copy.
+# Otherwise the NumPy path below is used; both give the same results.
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def block_moments_numpy(stack):
+    """Return (count, mean, co-moment, min, max) over the NaN-free rows of an (n, k) block."""
+    # A single NaN mask, AND-ed one raster at a time (no n x k boolean temporary), avoids
+    # the float64 upcast and full-size copies of a pandas dropna().
+    valid = np.ones(stack.shape[0], dtype=bool)
+    for i in range(stack.shape[1]):
+        valid &= ~np.isnan(stack[:, i])
+
+    n_b = np.count_nonzero(valid)
+    if n_b == 0:
+        return 0, None, None, None, None
+    Z = stack[valid]  # contiguous (n_b, k) float32 gather of the valid rows only
+
+    mean_b = Z.mean(axis=0, dtype=np.float64)
+    dev = Z - mean_b
+    comoment_b = dev.T @ dev  # single BLAS matrix product for all k x k pairs
+    return n_b, mean_b, comoment_b, Z.min(axis=0), Z.max(axis=0)
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def block_moments_numba(stack):
+        """Compiled equivalent of block_moments_numpy (rows split across threads)."""
+        n, k = stack.shape
+        n_chunks = numba.get_num_threads()
+        bounds = np.linspace(0, n, n_chunks + 1).astype(np.int64)
+
+        # Pass 1: NoData test, per-thread counts, sums, min and max
+        valid = np.empty(n, dtype=np.bool_)
+        counts = np.zeros(n_chunks, dtype=np.int64)
+        sums = np.zeros((n_chunks, k))
+        mins = np.full((n_chunks, k), np.inf)
+        maxs = np.full((n_chunks, k), -np.inf)
+        for c in numba.prange(n_chunks):
+            for r in range(bounds[c], bounds[c + 1]):
+                ok = True
+                for a in range(k):
+                    if np.isnan(stack[r, a]):
+                        ok = False
+                        break
+                valid[r] = ok
+                if ok:
+                    counts[c] += 1
+                    for a in range(k):
+                        v = stack[r, a]
+                        sums[c, a] += v
+                        mins[c, a] = min(mins[c, a], v)
+                        maxs[c, a] = max(maxs[c, a], v)
+
+        n_b = counts.sum()
+        mean_b = np.zeros(k)
+        min_b = np.full(k, np.inf)
+        max_b = np.full(k, -np.inf)
+        for c in range(n_chunks):
+            for a in range(k):
+                mean_b[a] += sums[c, a]
+                min_b[a] = min(min_b[a], mins[c, a])
+                max_b[a] = max(max_b[a], maxs[c, a])
+        mean_b /= max(n_b, 1)
 
-min_rows = min(arr.shape[0] for arr in arrays.values())
-min_cols = min(arr.shape[1] for arr in arrays.values())
+        # Pass 2: per-thread co-moments around the block mean (upper triangle)
+        partial = np.zeros((n_chunks, k, k))
+        for c in numba.prange(n_chunks):
+            dev = np.empty(k)
+            for r in range(bounds[c], bounds[c + 1]):
+                if valid[r]:
+                    for a in range(k):
+                        dev[a] = stack[r, a] - mean_b[a]
+                    for a in range(k):
+                        for b in range(a, k):
+                            partial[c, a, b] += dev[a] * dev[b]
 
-for key in arrays:
-    arrays[key] = arrays[key][:min_rows, :min_cols]
+        comoment_b = np.zeros((k, k))
+        for c in range(n_chunks):
+            for a in range(k):
+                for b in range(a, k):
+                    comoment_b[a, b] += partial[c, a, b]
+        for a in range(k):
+            for b in range(a):
+                comoment_b[a, b] = comoment_b[b, a]
+        return n_b, mean_b, comoment_b, min_b, max_b
+
+    block_moments = block_moments_numba
+else:
+    block_moments = block_moments_numpy
+
+
+def stream_moments():
+    """Stream every block once; return (count, mean, co-moment, min, max) over all valid pixels."""
+    n_valid = 0
+    mean = np.zeros(k, dtype=np.float64)
+    comoment = np.zeros((k, k), dtype=np.float64)
+    vmin = np.full(k, np.inf)
+    vmax = np.full(k, -np.inf)
+
+    for r0, c0, bh, bw in tile_iter(min_rows, min_cols):
+        print(f"Processing block at row {r0}, col {c0} ({bh} x {bw})")
+        # Column-major buffer: each raster block is copied into one contiguous column and
+        # released immediately, so only one raster block is live besides the stack.
+        stack = np.empty((bh * bw, k), dtype=np.float32, order="F")
+        for i, name in enumerate(names):
+            stack[:, i] = read_block(rasters[name], r0, c0, bh, bw).ravel()
+
+        n_b, mean_b, comoment_b, min_b, max_b = block_moments(stack)
+        del stack
+        if n_b == 0:
+            continue
+
+        n_total = n_valid + n_b
+        delta = mean_b - mean
+        comoment += comoment_b + np.outer(delta, delta) * (n_valid * n_b / n_total)
+        mean += delta * (n_b / n_total)
+        n_valid = n_total
+
+        np.minimum(vmin, min_b, out=vmin)
+        np.maximum(vmax, max_b, out=vmax)
+
+    return n_valid, mean, comoment, vmin, vmax
+
+
+# The accumulated statistics only change when the input rasters do, so with use_stats_cache
+# they are cached in the output folder, keyed by stats_cache_tag, raster names and each
+# raster's own signature (grid properties plus file time or sampled checksum, see
+# common/raster_cache.py). Reruns (e.g. while tuning the threshold or the heatmap) then
+# skip the raster pass entirely; a cache left by earlier inputs is replaced.
+cache_path = None
+if use_stats_cache:
+    cache_path = stats_cache_path(
+        output_dir, "corr_cache",
+        [stats_cache_tag] + [(name, raster_signature(path)) for name, path in raster_dict.items()]
+    )
+
+if cache_path and os.path.exists(cache_path):
+    print(f"Loading cached statistics: {cache_path}")
+    with np.load(cache_path) as cached:
+        n_valid = int(cached["n_valid"])
+        mean, comoment = cached["mean"], cached["comoment"]
+        vmin, vmax = cached["vmin"], cached["vmax"]
+else:
+    n_valid, mean, comoment, vmin, vmax = stream_moments()
+    if cache_path:
+        np.savez(cache_path, n_valid=n_valid, mean=mean, comoment=comoment,
+                 vmin=vmin, vmax=vmax)
+
+print(f"✅ {n_valid} valid pixels retained for correlation analysis.")
 
 # ---------------------------------------------------------------------
-# STEP 4: STACK RASTER PIXEL VALUES INTO A PANDAS DATAFRAME
+# STEP 4: SAMPLE STANDARD DEVIATION
 # ---------------------------------------------------------------------
-# This flattens each 2D array into a 1D vector, one per raster.
-# The resulting DataFrame (`df`) represents the pixel-aligned values across all rasters.
-# Rows with any NaN (NoData) are dropped to avoid bias in correlation analysis.
+# Sample (n - 1) standard deviation, matching pandas' describe()/std().
 
-df = pd.DataFrame({name: arr.flatten() for name, arr in arrays.items()})
-df = df.dropna()
-print(f"✅ {len(df)} valid pixels retained for correlation analysis.")
+std = np.sqrt(np.diag(comoment) / (n_valid - 1))
 
 # ---------------------------------------------------------------------
 # STEP 5: Z-SCORE NORMALIZATION
@@ -89,8 +273,9 @@ print(f"✅ {len(df)} valid pixels retained for correlation analysis.")
 # 📈 Why normalize?
 # Terrain variables differ in units and magnitude (e.g., elevation in meters vs curvature).
 # Z-score normalization (mean = 0, std = 1) ensures variables contribute equally to correlation.
-
-df_z = (df - df.mean()) / df.std()
+# The Pearson coefficient of the z-scores equals the co-moment scaled by the two
+# standard deviations, so the normalization is applied analytically to the
+# accumulated co-moment matrix rather than to every pixel.
 
 # ---------------------------------------------------------------------
 # STEP 6: GLOBAL STATISTICS AND CORRELATION MATRIX
@@ -98,9 +283,14 @@ df_z = (df - df.mean()) / df.std()
 # Compute basic summary statistics (mean, std) and full descriptive stats (min, max).
 # Calculate the Pearson correlation coefficient (linear association) between all pairs.
 
-summary_stats = df.describe().T[['mean', 'std']]
-full_stats = df.describe().T[['min', 'max', 'mean', 'std']]
-correlation_matrix = df.corr(method='pearson')
+# All four statistics come from the single accumulation pass above (no describe() rescan);
+# the summary table is a column subset of the full table.
+full_stats = pd.DataFrame({'min': vmin, 'max': vmax, 'mean': mean, 'std': std}, index=names)
+summary_stats = full_stats[['mean', 'std']]
+
+# Covariance of the z-scores: C = (Z.T @ Z) / (n - 1), with Z = (X - mean) / std
+correlation_matrix = pd.DataFrame(comoment / ((n_valid - 1) * np.outer(std, std)),
+                                  index=names, columns=names)
 
 # ---------------------------------------------------------------------
 # STEP 7: VISUALIZE CORRELATIONS AS A HEATMAP
@@ -108,8 +298,20 @@ correlation_matrix = df.corr(method='pearson')
 # A color-coded matrix makes it easy to identify strongly related or redundant variables.
 # Blue = negative correlation; Red = positive; White = neutral.
 
-plt.figure(figsize=(10, 8))
-sns.heatmap(correlation_matrix, annot=True, fmt=".2f", cmap="coolwarm", square=True)
+# Drawn directly with imshow + text labels (no seaborn import); the color scale is fixed
+# to the full Pearson range so figures from different runs are directly comparable.
+fig, ax = plt.subplots(figsize=(10, 8))
+im = ax.imshow(correlation_matrix.to_numpy(), cmap="coolwarm", vmin=-1, vmax=1, aspect="equal")
+ax.set_xticks(range(k))
+ax.set_xticklabels(correlation_matrix.columns, rotation=45, ha="right")
+ax.set_yticks(range(k))
+ax.set_yticklabels(correlation_matrix.index)
+for i in range(k):
+    for j in range(k):
+        r, g, b, _ = im.cmap(im.norm(correlation_matrix.iat[i, j]))
+        text_color = "black" if (0.2126 * r + 0.7152 * g + 0.0722 * b) > 0.408 else "white"
+        ax.text(j, i, f"{correlation_matrix.iat[i, j]:.2f}", ha="center", va="center", color=text_color)
+fig.colorbar(im, ax=ax)
 plt.title("Global Pearson Correlation Matrix (Z-score Normalized)", fontsize=14)
 plt.tight_layout()
 
@@ -119,7 +321,7 @@ plt.savefig(heatmap_path, dpi=300)
 plt.show()
 
 # ---------------------------------------------------------------------
-# STEP 8: EXPORT OUTPUT TABLES TO CSV
+# STEP 8: EXPORT OUTPUT TABLES TO CSV (AND PARQUET)
 # ---------------------------------------------------------------------
 # These files can be included in your Methods, Results, or Appendix.
 # They provide transparent justification for your variable selection choices.
@@ -128,6 +330,15 @@ summary_stats.to_csv(os.path.join(output_dir, "global_stats.csv"))
 full_stats.to_csv(os.path.join(output_dir, "global_stats_full.csv"))
 correlation_matrix.to_csv(os.path.join(output_dir, "correlation_matrix.csv"))
 
+# Parquet copies for downstream scripts: binary, typed, and faster to reload than CSV.
+# Requires pyarrow (or fastparquet); skipped with a message if neither is installed.
+try:
+    summary_stats.to_parquet(os.path.join(output_dir, "global_stats.parquet"))
+    full_stats.to_parquet(os.path.join(output_dir, "global_stats_full.parquet"))
+    correlation_matrix.to_parquet(os.path.join(output_dir, "correlation_matrix.parquet"))
+except ImportError:
+    print("Parquet engine not available; only CSV tables were written.")
+
 # ---------------------------------------------------------------------
 # STEP 9: IDENTIFY HIGHLY CORRELATED PAIRS (|r| > 0.85)
 # ---------------------------------------------------------------------
@@ -136,13 +347,18 @@ correlation_matrix.to_csv(os.path.join(output_dir, "correlation_matrix.csv"))
 # from your composite image or machine learning input.
 
 threshold = 0.85
-# Extract upper triangle of matrix (no repeats)
-upper_tri = correlation_matrix.where(np.triu(np.ones(correlation_matrix.shape), k=1).astype(bool))
+# Index the upper triangle of the matrix directly (no repeats, no diagonal)
+var_names = correlation_matrix.columns.to_numpy()
+iu = np.triu_indices(len(var_names), k=1)
+pair_r = correlation_matrix.to_numpy()[iu]
+sel = np.abs(pair_r) > threshold
 
-# Stack into long-form table
-high_corr_pairs = upper_tri.stack().reset_index()
-high_corr_pairs.columns = ['Variable 1', 'Variable 2', 'Correlation']
-high_corr_filtered = high_corr_pairs[high_corr_pairs['Correlation'].abs() > threshold]
+# Long-form table of the pairs exceeding the threshold
+high_corr_filtered = pd.DataFrame({
+    'Variable 1': var_names[iu[0]][sel],
+    'Variable 2': var_names[iu[1]][sel],
+    'Correlation': pair_r[sel]
+})
 
 # Print or export results
 if not high_corr_filtered.empty:
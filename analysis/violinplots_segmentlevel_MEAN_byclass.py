@@ -5,11 +5,13 @@
 #          with a compact legend panel suitable for letter-layout figures.
 # Notes: Snapshot of the script used for the MGISA final report (Schema D: no TERRACE class).
 #        Logic unchanged; only file paths and output filename generalized.
-# Inputs: Update 'csv_path' to your merged segment-stats CSV (must include NameD and *_MEAN fields).
+# Inputs: Update 'csv_path' to your merged segment-stats CSV (must include NameD and *_MEAN fields),
+#         or set 'source_table' to read the same fields directly from a GDB table (requires arcpy).
 # Outputs: 'ViolinPlots_SegmentStats_ByClass_MEAN_SchemaD.png' written next to the CSV by default.
 # Citation: Robillard (2025). *MGISA landform mapping scripts* [Computer software]. GitHub. 
 # ------------------------------------------------------------------------
 
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -23,6 +25,10 @@ import os
 # SRI_MEAN, CurvT_MEAN, CurvPr_MEAN, Elev_MEAN)
 csv_path = r"C:\path\to\Outputs\Toba_SegmentStats_SMSv7_MERGED.csv"  # <-- replace with your CSV
 
+# Optional: read directly from a GDB table/feature class instead of the CSV (requires arcpy),
+# e.g. the table written by zonalstats_3_with_ref_classes.py. Leave as None to use the CSV.
+source_table = None  # e.g., r"C:\path\to\Outputs\SegmentStats.gdb\ZStats_ALL_SMSv7_wClasses"
+
 # Output figure path (defaults to same folder as CSV)
 output_path = os.path.join(
     os.path.dirname(csv_path),
@@ -30,15 +36,7 @@ output_path = os.path.join(
 )
 
 # -------------------------------------------------------------------------
-# STEP 2: Load Data
-# -------------------------------------------------------------------------
-df = pd.read_csv(csv_path)
-name_col = "NameD" if "NameD" in df.columns else "NameB" #NameD reflect Schema D class name
-if name_col not in df.columns:
-    raise ValueError("Required field with class names ('NameD' or 'NameB') not found in input CSV.")
-
-# -------------------------------------------------------------------------
-# STEP 3: Schema D classes, short labels, colors
+# STEP 2: Schema D classes, short labels, colors
 # -------------------------------------------------------------------------
 class_order_full = [  # (Schema D) TERRACE removed
     "WATER BODY", "SMOOTH SNOW/ICEFIELD", "CREVASSE-RICH ICE",
@@ -90,24 +88,55 @@ class_colors_full = {
 }
 short_colors = {label_map[k]: v for k, v in class_colors_full.items()}
 
-# Keep only Schema D rows and add short label column
-df = df[df[name_col].isin(class_order_full)].copy()
-df["LabelShort"] = df[name_col].map(label_map)
-
 # -------------------------------------------------------------------------
-# STEP 4: Variables and grid
+# STEP 3: Variables and grid
 # -------------------------------------------------------------------------
 gv_fields = ["TPI1_MEAN", "TPI2_MEAN", "Slope_MEAN", "SRI_MEAN",
              "CurvT_MEAN", "CurvPr_MEAN", "Elev_MEAN"]
 subplot_titles = [field.replace("_MEAN", "") for field in gv_fields]
 
+# -------------------------------------------------------------------------
+# STEP 4: Load Data (class field + GV fields, Schema D rows only)
+# -------------------------------------------------------------------------
+if source_table:
+    # Read straight from the geodatabase: the class filter is pushed into the table scan
+    # as a where-clause and only the needed fields are transferred.
+    import arcpy
+    table_fields = [f.name for f in arcpy.ListFields(source_table)]
+    name_col = "NameD" if "NameD" in table_fields else "NameB" #NameD reflect Schema D class name
+    if name_col not in table_fields:
+        raise ValueError("Required field with class names ('NameD' or 'NameB') not found in input table.")
+    where = "{} IN ({})".format(
+        arcpy.AddFieldDelimiters(source_table, name_col),
+        ", ".join(f"'{c}'" for c in class_order_full)
+    )
+    df = pd.DataFrame(arcpy.da.TableToNumPyArray(
+        source_table, [name_col] + gv_fields, where_clause=where,
+        null_value={field: np.nan for field in gv_fields}
+    ))
+else:
+    csv_columns = pd.read_csv(csv_path, nrows=0).columns
+    name_col = "NameD" if "NameD" in csv_columns else "NameB" #NameD reflect Schema D class name
+    if name_col not in csv_columns:
+        raise ValueError("Required field with class names ('NameD' or 'NameB') not found in input CSV.")
+    df = pd.read_csv(csv_path, usecols=[name_col] + gv_fields)
+    df = df[df[name_col].isin(class_order_full)].copy()
+
+# Add short label column as a categorical: class names are encoded once against the
+# Schema D order and the integer codes are reused for the short labels (no per-row lookup)
+class_codes = pd.Categorical(df[name_col], categories=class_order_full).codes
+df["LabelShort"] = pd.Categorical.from_codes(class_codes, categories=order_short)
+
 # -------------------------------------------------------------------------
 # STEP 5: Clip 1st–99th percentiles (to eliminate outliers from plots)
 # -------------------------------------------------------------------------
-for field in gv_fields:
-    lower = df[field].quantile(0.01)
-    upper = df[field].quantile(0.99)
-    df[field] = df[field].clip(lower, upper)
+# Both bounds for every field come from one selection-based quantile call
+# (NaNs ignored, as with Series.quantile) instead of 14 separate column sorts,
+# and all fields are then clipped in place in a single 2-D pass.
+gv_values = df[gv_fields].to_numpy(dtype=float)
+lower, upper = np.nanquantile(gv_values, [0.01, 0.99], axis=0)
+np.clip(gv_values, lower, upper, out=gv_values)
+df[gv_fields] = gv_values
 
 # -------------------------------------------------------------------------
 # STEP 6: Plot grid (2 cols x 4 rows); bottom-right reserved for legend
@@ -117,21 +146,51 @@ fig, axes = plt.subplots(nrows=4, ncols=2, figsize=(8.5, 13),
                          gridspec_kw={"hspace": 0.35, "wspace": 0.04})
 axes = axes.flatten()
 
+# Split the clipped values by class once; each subplot then reuses the same per-class
+# arrays instead of re-filtering the full table for every violin.
+groups = {lbl: sub[gv_fields].to_numpy() for lbl, sub in df.groupby("LabelShort", observed=True)}
+positions = np.arange(len(order_short))
+edge_color = "0.25"
+
 # Draw 7 violins into the first 7 axes; leave axes[-1] empty for legend
 for i, (field, title) in enumerate(zip(gv_fields, subplot_titles)):
     ax = axes[i]
-    sns.violinplot(
-        data=df,
-        y="LabelShort",
-        x=field,
-        order=order_short,
-        palette=[short_colors[s] for s in order_short],
-        ax=ax,
-        linewidth=1.0,
-        inner="box",
-        scale="width",
-        cut=0
-    )
+
+    # Per-class values for this field (classes with too few distinct values have no KDE)
+    data, pos, colors = [], [], []
+    for p, lbl in zip(positions, order_short):
+        if lbl not in groups:
+            continue
+        vals = groups[lbl][:, i]
+        vals = vals[~np.isnan(vals)]
+        if vals.size > 1 and np.ptp(vals) > 0:
+            data.append(vals)
+            pos.append(p)
+            colors.append(short_colors[lbl])
+
+    # Same width for every violin, KDE limited to the data range (scale="width", cut=0)
+    if data:
+        parts = ax.violinplot(data, positions=pos, vert=False, widths=0.8,
+                              showmeans=False, showextrema=False)
+        for body, color in zip(parts["bodies"], colors):
+            body.set_facecolor(color)
+            body.set_edgecolor(edge_color)
+            body.set_linewidth(1.0)
+            body.set_alpha(1.0)
+
+    # Inner box: 1.5 IQR whiskers, interquartile bar and white median point
+    for p, vals in zip(pos, data):
+        q1, med, q3 = np.percentile(vals, [25, 50, 75])
+        iqr = q3 - q1
+        whisk_lo = vals[vals >= q1 - 1.5 * iqr].min()
+        whisk_hi = vals[vals <= q3 + 1.5 * iqr].max()
+        ax.hlines(p, whisk_lo, whisk_hi, color=edge_color, linewidth=1.0, zorder=2)
+        ax.hlines(p, q1, q3, color=edge_color, linewidth=4.0, zorder=2)
+        ax.scatter(med, p, color="white", s=12, zorder=3)
+
+    ax.set_yticks(positions)
+    ax.set_yticklabels(order_short)
+    ax.set_ylim(len(order_short) - 0.5, -0.5)  # first class at the top
     ax.set_title(title, fontsize=12, fontweight="bold")
     ax.set_xlabel("")
     ax.set_ylabel("")
@@ -11,6 +11,9 @@
 
 import arcpy
 import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 # --- USER INPUTS ---
 
@@ -37,34 +40,116 @@ raster_inputs = [
 # Field in polygon layer used to join stats (must be integer)
 zone_field = "Id"
 
+# Number of rasters processed concurrently (each worker is a separate ArcPy process with
+# its own scratch and output GDB; tables are copied into output_gdb afterwards).
+# Set to 1 to run sequentially.
+max_workers = min(4, len(raster_inputs), os.cpu_count() or 1)
+
+
 # --- ENVIRONMENT SETUP ---
-arcpy.env.workspace = output_gdb
-arcpy.env.snapRaster = snap_raster
-arcpy.env.extent = segment_fc
-arcpy.env.cellSize = snap_raster
-arcpy.env.overwriteOutput = True
+def set_environment():
+    """Apply the shared processing environment (called in the main and each worker process)."""
+    arcpy.env.workspace = output_gdb
+    arcpy.env.snapRaster = snap_raster
+    arcpy.env.extent = segment_fc
+    arcpy.env.cellSize = snap_raster
+    arcpy.env.overwriteOutput = True
+
+
+# --- WORKER SETUP ---
+# Concurrent ArcPy processes sharing one scratch GDB, or writing tables into one FGDB at
+# the same time, run into schema locks and "dataset already exists" errors. Each pool
+# worker therefore gets its own folder with a GDB that serves as both its scratch
+# workspace and the target of its output tables; the main process copies the tables
+# into output_gdb once the pool has finished.
+worker_gdb = None  # set in pool workers only
 
-# --- PROCESS EACH RASTER ---
 
-for raster_path, prefix in raster_inputs:
-    print(f"Processing: {os.path.basename(raster_path)}")
+def init_worker(root_folder):
+    """Pool initializer: create this worker's private GDB and use it as scratch workspace."""
+    global worker_gdb
+    folder = tempfile.mkdtemp(prefix="zstats_worker_", dir=root_folder)
+    worker_gdb = os.path.join(folder, "work.gdb")
+    arcpy.management.CreateFileGDB(folder, "work.gdb")
+    arcpy.env.scratchWorkspace = worker_gdb
+
+
+# --- PROCESS ONE RASTER ---
+def run_one(item):
+    """Run Zonal Statistics as Table for one (raster path, prefix, zone raster) item."""
+    raster_path, prefix, zone_raster = item
+    set_environment()
+    arcpy.CheckOutExtension("Spatial")
 
     # Define output table name
     table_name = f"ZStats_{prefix}_SMS" #SMS suffix to indicate version (e.g., SMSv7)
 
-    # Full path for output table
-    out_table = os.path.join(output_gdb, table_name)
+    # Full path for output table (in the worker's own GDB when running in the pool)
+    out_table = os.path.join(worker_gdb or output_gdb, table_name)
 
     # Run Zonal Statistics as Table tool
     arcpy.sa.ZonalStatisticsAsTable(
-        in_zone_data=segment_fc,
-        zone_field=zone_field,
+        in_zone_data=zone_raster,
+        zone_field="Value",
         in_value_raster=raster_path,
         out_table=out_table,
         ignore_nodata="DATA",
         statistics_type="ALL"
     )
 
-    print(f" -> Output saved to: {out_table}")
+    # Zone raster cells carry the segment Id in "Value"; restore the original key name
+    arcpy.management.AlterField(out_table, "Value", zone_field, zone_field)
+
+    return os.path.basename(raster_path), out_table
+
+
+def main():
+    set_environment()
+
+    # --- RASTERIZE ZONES ONCE ---
+    # ZonalStatisticsAsTable converts polygon zones to a raster on every call. Converting the
+    # segments once (same snap raster, extent and cell size, cell-center assignment) and reusing
+    # that zone raster for all inputs avoids repeating the conversion for each raster.
+    zone_raster = arcpy.CreateUniqueName("zones_SMS", arcpy.env.scratchGDB)
+    arcpy.conversion.PolygonToRaster(
+        in_features=segment_fc,
+        value_field=zone_field,
+        out_rasterdataset=zone_raster,
+        cell_assignment="CELL_CENTER"
+    )
+
+    # --- PROCESS EACH RASTER ---
+    # The runs are independent (same zones, different value raster and output table), so
+    # they are spread over a process pool; wall time approaches the slowest single raster.
+    items = [(raster_path, prefix, zone_raster) for raster_path, prefix in raster_inputs]
+    print(f"Processing {len(items)} rasters with {max_workers} worker(s)")
+
+    # The worker GDBs and the zone raster are removed even if a run fails
+    worker_root = None
+    try:
+        if max_workers > 1:
+            worker_root = tempfile.mkdtemp(prefix="zstats_", dir=arcpy.env.scratchFolder)
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                     initargs=(worker_root,)) as executor:
+                results = list(executor.map(run_one, items))
+            # Workers have exited (no locks left); copy their tables into output_gdb one by one
+            for raster_name, worker_table in results:
+                out_table = os.path.join(output_gdb, os.path.basename(worker_table))
+                arcpy.management.Copy(worker_table, out_table)
+                print(f"Processed: {raster_name}\n -> Output saved to: {out_table}")
+        else:
+            for item in items:
+                raster_name, out_table = run_one(item)
+                print(f"Processed: {raster_name}\n -> Output saved to: {out_table}")
+    finally:
+        if worker_root:
+            shutil.rmtree(worker_root, ignore_errors=True)
+        # Remove the temporary zone raster
+        arcpy.management.Delete(zone_raster)
+
+    print("\nAll zonal statistics tables created successfully.")
+
 
-print("\nAll zonal statistics tables created successfully.")
+# Guard required: worker processes re-import this module on Windows (spawn start method)
+if __name__ == "__main__":
+    main()
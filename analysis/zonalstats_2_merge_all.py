@@ -9,6 +9,7 @@
 # Citation: Robillard (2025). *MGISA landform mapping scripts* [Computer software]. GitHub.
 
 import arcpy
+import numpy as np
 import os
 
 # -----------------------------
@@ -25,7 +26,7 @@ merged_table_name = "ZStats_ALL_SMSv7"                 # keep or adjust naming a
 merged_table_path = os.path.join(output_gdb, merged_table_name)
 
 # List of input ZStats tables with the fields to keep from each
-# NOTE: The first entry will be used as the base table; others will be joined to it
+# NOTE: The first entry will be used as the base table; others will be joined to it on "Id"
 # NOTE: SMSv7 refers to the version (v7) of SMS parameters used in Robillard (2025)
 zstats_tables = [
     ("ZStats_Elev_SMSv7", ["Id", "COUNT", "AREA", "Elev_MEAN", "Elev_STDV"]),
@@ -41,54 +42,43 @@ zstats_tables = [
 arcpy.env.overwriteOutput = True
 
 # -----------------------------
-# STEP 1: COPY INITIAL TABLE WITH ONLY SELECTED FIELDS
+# STEP 1: WRITE THE BASE TABLE WITH ONLY THE SELECTED FIELDS
 # -----------------------------
 
-# Use the first table in the list as the base table to build from
-initial_table, initial_fields = zstats_tables[0]
-initial_table_path = os.path.join(output_gdb, initial_table)
+# The first table is the base table (all of its rows are kept); it is read once with
+# only the selected fields and written as the merged table.
+base_table, base_fields = zstats_tables[0]
+print(f"\n📥 Reading fields from: {base_table}")
+print(f"   Fields: {', '.join(base_fields)}")
+base_arr = arcpy.da.TableToNumPyArray(os.path.join(output_gdb, base_table), base_fields)
 
-# Create a FieldMappings object to control which fields are copied
-field_mappings = arcpy.FieldMappings()
-
-# Add each desired field (e.g., Id, COUNT, AREA, Elev_MEAN, Elev_STDV) to the mapping
-for field in initial_fields:
-    field_map = arcpy.FieldMap()
-    field_map.addInputField(initial_table_path, field)
-    field_mappings.addFieldMap(field_map)
-
-# Export the filtered fields from the base table into a new table (merged output)
-arcpy.conversion.TableToTable(
-    in_rows=initial_table_path,
-    out_path=output_gdb,
-    out_name=merged_table_name,
-    field_mapping=field_mappings
-)
-
-print(f"✅ Created initial table: {merged_table_name}")
-print(f"   Included fields: {', '.join(initial_fields)}")
+# NumPyArrayToTable does not honour overwriteOutput, so remove any previous output first
+if arcpy.Exists(merged_table_path):
+    arcpy.management.Delete(merged_table_path)
+arcpy.da.NumPyArrayToTable(base_arr, merged_table_path)
 
 # -----------------------------
-# STEP 2: JOIN REMAINING TABLES TO THE MERGED TABLE
+# STEP 2: JOIN THE OTHER TABLES ON "Id"
 # -----------------------------
 
-# Loop through the remaining tables (starting from index 1)
-for table_name, fields_to_join in zstats_tables[1:]:
-    join_table_path = os.path.join(output_gdb, table_name)
+# Each table is read once (Id + selected fields) and added with one ExtendTable call,
+# instead of one JoinField rewrite per table. As with JoinField, the first row per Id
+# wins and merged rows without a match get NULL.
+included = list(base_fields)
+for table_name, fields in zstats_tables[1:]:
+    read_fields = fields if "Id" in fields else ["Id"] + fields
 
     print(f"\n🔄 Joining fields from: {table_name}")
-    print(f"   Fields: {', '.join(fields_to_join)}")
-
-    # Perform attribute join using the common "Id" field
-    arcpy.management.JoinField(
-        in_data=merged_table_path,   # destination table
-        in_field="Id",               # join field in destination
-        join_table=join_table_path,  # source table to join
-        join_field="Id",             # join field in source table
-        fields=fields_to_join        # list of fields to bring in
-    )
-
-    print(f"   ✅ Successfully joined {len(fields_to_join)} fields.")
+    print(f"   Fields: {', '.join(fields)}")
+
+    join_arr = arcpy.da.TableToNumPyArray(os.path.join(output_gdb, table_name), read_fields)
+    _, first = np.unique(join_arr["Id"], return_index=True)
+    arcpy.da.ExtendTable(merged_table_path, "Id", join_arr[np.sort(first)], "Id",
+                         append_only=False)
+    included += [f for f in fields if f != "Id"]
+
+print(f"\n✅ Created merged table: {merged_table_name}")
+print(f"   Included fields: {', '.join(included)}")
 
 # -----------------------------
 # FINAL MESSAGE
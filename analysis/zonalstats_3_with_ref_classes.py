@@ -12,6 +12,7 @@
 # ------------------------------------------------------------------------
 
 import arcpy
+import numpy as np
 import os
 
 # ------------------------------------------------------------------------
@@ -33,25 +34,54 @@ zstats_all = r"C:\path\to\Outputs\SegmentStats.gdb\ZStats_ALL_SMSv7"
 output_gdb = r"C:\path\to\Outputs\SegmentStats.gdb"
 output_table = "ZStats_ALL_SMSv7_wClasses"  # adjust if you prefer a different name
 
-# --- STEP 1: Copy the merged stats table to a new version ---
-zstats_with_classes = arcpy.management.CopyRows(
-    zstats_all,
-    os.path.join(output_gdb, output_table)
-)[0]
-print(f"✅ Created new table with class info: {output_table}")
-
-# --- STEP 2: Join class fields from the polygon layer ---
 # These fields help interpret class membership (Schema D) for each segment Id
 fields_to_join = ["CodeD", "NameD", "PERCENTAGE", "gridcode"]  # modify if needed
 
-arcpy.management.JoinField(
-    in_data=zstats_with_classes,  # the newly copied stats table
-    in_field="Id",                # unique segment Id in the stats table
-    join_table=segment_fc,        # polygon FC with reference class labels (ref_classes)
-    join_field="Id",              # common join key
-    fields=fields_to_join         # fields of interest
-)
+# --- STEP 1: Copy the merged stats table ---
+output_path = os.path.join(output_gdb, output_table)
+if arcpy.Exists(output_path):
+    arcpy.management.Delete(output_path)
+arcpy.management.CopyRows(zstats_all, output_path)
+
+# --- STEP 2: Read the class fields into memory ---
+# Only the join key and the class fields are read from the polygon layer, in one scan.
+# Nulls are read as per-field sentinels (skip_nulls would drop the whole segment) and
+# restored as NULL after the join, so integer fields keep their type and NULL semantics.
+NULL_SENTINELS = {
+    "SmallInteger": np.iinfo(np.int16).min,
+    "Integer": np.iinfo(np.int32).min,
+    "BigInteger": np.iinfo(np.int64).min,
+    "Single": np.nan,
+    "Double": np.nan,
+    "String": "\x01",   # a control character never used in class names ("\x00" reads back as "")
+}
+field_types = {f.name: f.type for f in arcpy.ListFields(segment_fc)}
+null_values = {name: NULL_SENTINELS[field_types[name]] for name in ["Id"] + fields_to_join}
+class_arr = arcpy.da.FeatureClassToNumPyArray(segment_fc, ["Id"] + fields_to_join,
+                                              skip_nulls=False, null_value=null_values)
+# Keep the first row per Id, as JoinField does
+_, first = np.unique(class_arr["Id"], return_index=True)
+class_arr = class_arr[np.sort(first)]
 
+# --- STEP 3: Join class fields to the stats rows on "Id" ---
+# ExtendTable adds the class fields in a single write; stats rows without a matching
+# segment get NULL, as with JoinField.
+arcpy.da.ExtendTable(output_path, "Id", class_arr, "Id", append_only=False)
+
+# Null class values inside matched segments were written as sentinels; set them back to
+# NULL (only fields that actually contain nulls are visited).
+null_fields = [name for name in fields_to_join
+               if (np.isnan(class_arr[name]).any() if class_arr.dtype[name].kind == "f"
+                   else (class_arr[name] == null_values[name]).any())]
+if null_fields:
+    with arcpy.da.UpdateCursor(output_path, null_fields) as cursor:
+        for row in cursor:
+            new_row = [None if (v != v if isinstance(v, float) else v == null_values[name]) else v
+                       for name, v in zip(null_fields, row)]
+            if new_row != row:
+                cursor.updateRow(new_row)
+
+print(f"✅ Created new table with class info: {output_table}")
 print(f"✅ Joined class fields: {', '.join(fields_to_join)}")
 print(f"   Output table saved as: {output_table}")
 
@@ -32,13 +32,17 @@ stats_fields = [
     "CurvPr_MEAN","CurvPr_STDV"
 ]
 
-# --- Perform the join on the "Id" field ---
-arcpy.management.JoinField(
-    in_data=segment_fc,       # destination: polygon feature class
-    in_field="Id",            # join key
-    join_table=zstats_all,    # source: stats table
-    join_field="Id",          # join key
-    fields=stats_fields       # only bring in selected fields
+# --- Read the selected fields once and extend the feature class on the "Id" field ---
+# ExtendTable adds (or, with append_only=False, updates) all columns in a single write,
+# instead of JoinField's field-by-field rewrite of the feature class.
+stats_arr = arcpy.da.TableToNumPyArray(zstats_all, ["Id"] + stats_fields)
+
+arcpy.da.ExtendTable(
+    segment_fc,               # destination: polygon feature class
+    "Id",                     # join key in destination
+    stats_arr,                # source: selected stats fields
+    "Id",                     # join key in source array
+    append_only=False         # update fields that already exist from a previous run
 )
 
 print(f"✅ Successfully joined {len(stats_fields)} statistical fields to the segment feature class.")
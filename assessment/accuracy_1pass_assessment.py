@@ -16,17 +16,21 @@
 #        This script must be executed prior to generating confusion matrix
 #        figures, as it creates the summary tables required for plotting.
 # Inputs: Update the placeholder paths below (segment FC, RLP FC, output GDB).
-# Outputs: Intersect FC, confusion-matrix-like area table, totals tables,
+# Outputs: Tabulate Intersection table (or Intersect FC if WRITE_INTERSECT_FC;
+#          none with OVERLAY_ENGINE = "GEOPANDAS"),
+#          confusion-matrix-like area table, totals tables,
 #          per-class accuracy table, and OA table (written to output GDB).
 # Citation: Robillard (2025). *MGISA landform mapping scripts* [Computer software]. GitHub.
 # =============================================================================
 
 import arcpy
+import os
 import pandas as pd
 import numpy as np
 from datetime import datetime
 
 arcpy.env.overwriteOutput = True
+arcpy.env.parallelProcessingFactor = "100%"   # let Pairwise/parallel-capable tools use all cores
 
 # ===== PARAMS (EDIT THESE PATHS/NAMES) ======================================
 # Inputs
@@ -42,8 +46,18 @@ OUT_GDB = r"C:\path\to\Accuracy_Assessment.gdb"  # destination FGDB for all outp
 RUN_TAG = "TrialRunXX"       # short run label (e.g., "LT_TrialRun11")
 TAG     = "E5"               # classifier tag (e.g., "RT_D50", "RT_D60", "SVM_D50", "SVM_D60", "E5")
 
-# Intersect output (feature class)
+# Intersect output (feature class). The intersect geometry is only needed for mapping
+# correct/incorrect areas; the metrics need only the (Ref, Pred) -> area table, which
+# TabulateIntersection produces directly without writing clipped polygons.
+WRITE_INTERSECT_FC = False   # True = also build the intersect FC (RefClass/PredClass/Correct)
 INTERSECT_FC = fr"{OUT_GDB}\{RUN_TAG}_Segments_Intersect_RLPs_{TAG}"
+TABINT_TBL   = fr"{OUT_GDB}\{RUN_TAG}_{TAG}_TabulateIntersection_tbl"
+
+# Overlay engine for the CM areas when no intersect FC is written:
+#   "ARCPY"     = TabulateIntersection (default; no extra dependencies)
+#   "GEOPANDAS" = geopandas/shapely 2 (STRtree query + vectorized intersection areas);
+#                 requires geopandas with FileGDB read support (GDAL OpenFileGDB)
+OVERLAY_ENGINE = "ARCPY"
 
 # Added fields in intersect output
 REFCLASS_FIELD  = "RefClass"
@@ -58,63 +72,143 @@ PREDTOTALS_TBL = fr"{OUT_GDB}\{RUN_TAG}_{TAG}_PredTotals_tbl"
 # Final accuracy tables
 PERCLASS_TBL = fr"{OUT_GDB}\{RUN_TAG}_{TAG}_PerClassAccuracy_tbl"
 OA_TBL       = fr"{OUT_GDB}\{RUN_TAG}_{TAG}_OverallAccuracy_tbl"
+
+# Optional confusion-matrix figure, plotted from the in-memory CM table via
+# accuracy_confusion_matrix.plot_cm (no re-read of CM_TBL). None = skip.
+CM_PNG = None                # e.g., r"C:\path\to\Outputs\TrialRunXX_E5_CM.png"
 # ============================================================================
 
 def safe_delete(path):
     if arcpy.Exists(path):
         arcpy.Delete_management(path)
 
-# ----- 1) Intersect (same as UI settings) -----------------------------------
-# Attributes to Join: All attributes
-# Output type: Same as input (INPUT)
-safe_delete(INTERSECT_FC)
-arcpy.analysis.Intersect([SEG_FC, RLP_FC], INTERSECT_FC, "ALL", None, "INPUT")
-
-# ----- 2) Add and populate fields -------------------------------------------
-#   RefClass       = NameD from RLPs
-#   <TAG>_PredClass = prediction from segments (e.g., E5)
-#   <TAG>_Correct   = 1 if equal else 0
-for name, ftype, kwargs in [
-    (REFCLASS_FIELD, "TEXT", {"field_length": 50}),
-    (PREDCLASS_FIELD, "TEXT", {"field_length": 50}),
-    (CORRECT_FIELD, "SHORT", {}),
-]:
-    if not any(f.name.upper() == name.upper() for f in arcpy.ListFields(INTERSECT_FC)):
-        arcpy.AddField_management(INTERSECT_FC, name, ftype, **kwargs)
-
-# Calculate RefClass and PredClass
-arcpy.management.CalculateField(INTERSECT_FC, REFCLASS_FIELD, f"!{REF_CLASS_FIELD}!", "PYTHON3")
-arcpy.management.CalculateField(INTERSECT_FC, PREDCLASS_FIELD, f"!{PRED_FIELD}!", "PYTHON3")
-
-# Then calculate Correct (1 if equal)
-with arcpy.da.UpdateCursor(INTERSECT_FC, [REFCLASS_FIELD, PREDCLASS_FIELD, CORRECT_FIELD]) as cur:
-    for refv, predv, _ in cur:
-        cur.updateRow([refv, predv, 1 if (refv is not None and predv is not None and refv == predv) else 0])
-
-# ----- 3) Summary Statistics tables (these drive the metrics) ----------------
-# statistics_fields = [["Shape_Area", "SUM"]]
-# case fields:
-#   - CM table:      [RefClass, <TAG>_PredClass]
-#   - RefTotals:     [RefClass]
-#   - PredTotals:    [<TAG>_PredClass]
-safe_delete(CM_TBL)
-safe_delete(REFTOTALS_TBL)
-safe_delete(PREDTOTALS_TBL)
-
-arcpy.analysis.Statistics(INTERSECT_FC, CM_TBL, [["Shape_Area", "SUM"]], [REFCLASS_FIELD, PREDCLASS_FIELD])
-arcpy.analysis.Statistics(INTERSECT_FC, REFTOTALS_TBL, [["Shape_Area", "SUM"]], [REFCLASS_FIELD])
-arcpy.analysis.Statistics(INTERSECT_FC, PREDTOTALS_TBL, [["Shape_Area", "SUM"]], [PREDCLASS_FIELD])
+def write_area_table(df, path, class_fields):
+    """Write (class fields..., SUM_Shape_Area) rows from a DataFrame to a GDB table."""
+    safe_delete(path)
+    arr = np.empty(len(df), dtype=[(f, 'U50') for f in class_fields] + [('SUM_Shape_Area', 'f8')])
+    for f in class_fields + ['SUM_Shape_Area']:
+        arr[f] = df[f].to_numpy()
+    arcpy.da.NumPyArrayToTable(arr, path)
 
-# ----- 4) Build Per-Class Accuracy table -------------------------------------
-# Convert summaries to DataFrames
-df_cm = pd.DataFrame(arcpy.da.TableToNumPyArray(CM_TBL, [REFCLASS_FIELD, PREDCLASS_FIELD, 'SUM_Shape_Area']))
-df_ref = pd.DataFrame(arcpy.da.TableToNumPyArray(REFTOTALS_TBL, [REFCLASS_FIELD, 'SUM_Shape_Area']))
-df_pred = pd.DataFrame(arcpy.da.TableToNumPyArray(PREDTOTALS_TBL, [PREDCLASS_FIELD, 'SUM_Shape_Area']))
+def cm_area_table(ref_vals, pred_vals, areas):
+    """
+    SUM of area by (RefClass, PredClass) as a long table. Rows are accumulated by class
+    code into a small (n_ref, n_pred) matrix with np.add.at instead of a row-level groupby;
+    output order matches groupby (sorted by Ref, then Pred).
+    """
+    ref_codes, ref_cls = pd.factorize(np.asarray(ref_vals), sort=True)
+    pred_codes, pred_cls = pd.factorize(np.asarray(pred_vals), sort=True)
+    cm = np.zeros((len(ref_cls), len(pred_cls)), dtype=np.float64)
+    np.add.at(cm, (ref_codes, pred_codes), np.asarray(areas, dtype=np.float64))
+    seen = np.zeros(cm.shape, dtype=bool)
+    seen[ref_codes, pred_codes] = True
+    r, c = np.nonzero(seen)
+    return pd.DataFrame({REFCLASS_FIELD: np.asarray(ref_cls)[r],
+                         PREDCLASS_FIELD: np.asarray(pred_cls)[c],
+                         'SUM_Shape_Area': cm[r, c]})
+
+# Overlay tools rely on the spatial index of the reference polygons; build it if missing
+if not arcpy.Describe(RLP_FC).hasSpatialIndex:
+    arcpy.management.AddSpatialIndex(RLP_FC)
+
+if WRITE_INTERSECT_FC:
+    # ----- 1) Intersect (same as UI settings) -----------------------------------
+    # Attributes to Join: All attributes
+    # Output type: Same as input (INPUT)
+    # PairwiseIntersect gives the same result for two inputs and runs in parallel
+    safe_delete(INTERSECT_FC)
+    arcpy.analysis.PairwiseIntersect([SEG_FC, RLP_FC], INTERSECT_FC, "ALL", None, "INPUT")
+
+    # ----- 2) Add and populate fields -------------------------------------------
+    #   RefClass       = NameD from RLPs
+    #   <TAG>_PredClass = prediction from segments (e.g., E5)
+    #   <TAG>_Correct   = 1 if equal else 0
+    # The two class columns are read once, Correct is computed with one vectorized
+    # comparison, and all three fields are added in a single ExtendTable write
+    # (no CalculateField passes or per-row UpdateCursor).
+    # The polygon areas are read in the same pass and reused for step 3.
+    oid_field = arcpy.Describe(INTERSECT_FC).OIDFieldName
+    src = arcpy.da.FeatureClassToNumPyArray(
+        INTERSECT_FC, [oid_field, REF_CLASS_FIELD, PRED_FIELD, "SHAPE@AREA"],
+        null_value={REF_CLASS_FIELD: "", PRED_FIELD: ""}
+    )
+    ref_vals = src[REF_CLASS_FIELD].astype("U50")
+    pred_vals = src[PRED_FIELD].astype("U50")
+
+    new_fields = np.empty(len(src), dtype=[
+        (oid_field, 'i4'),
+        (REFCLASS_FIELD, 'U50'),
+        (PREDCLASS_FIELD, 'U50'),
+        (CORRECT_FIELD, 'i2')
+    ])
+    new_fields[oid_field] = src[oid_field]
+    new_fields[REFCLASS_FIELD] = ref_vals
+    new_fields[PREDCLASS_FIELD] = pred_vals
+    # 1 if equal (nulls, read as empty strings, never count as correct)
+    new_fields[CORRECT_FIELD] = (ref_vals == pred_vals) & (ref_vals != "") & (pred_vals != "")
+
+    arcpy.da.ExtendTable(INTERSECT_FC, oid_field, new_fields, oid_field, append_only=False)
+
+    # ----- 3) Confusion-matrix areas from the intersect FC --------------------
+    # SUM of Shape_Area by [RefClass, <TAG>_PredClass], accumulated in memory from the
+    # arrays read above instead of a Statistics sweep of the FC
+    df_cm_raw = cm_area_table(ref_vals, pred_vals, src["SHAPE@AREA"])
+    write_area_table(df_cm_raw, CM_TBL, [REFCLASS_FIELD, PREDCLASS_FIELD])
+elif OVERLAY_ENGINE == "GEOPANDAS":
+    # ----- 1-3) Confusion-matrix areas with geopandas/shapely ------------------
+    # Candidate (segment, RLP) pairs come from an STRtree query on the RLPs. Segments lying
+    # wholly inside their RLP contribute their own area; only the remaining boundary pairs
+    # are clipped, in one vectorized shapely call, and only their areas are kept.
+    import geopandas as gpd
+    import shapely
 
-# Rename columns for clarity/consistency
-df_cm   = df_cm.rename(columns={REFCLASS_FIELD: 'Ref', PREDCLASS_FIELD: 'Pred', 'SUM_Shape_Area': 'Area'})
-df_ref  = df_ref.rename(columns={REFCLASS_FIELD: 'Class', 'SUM_Shape_Area': 'Ref_Total_Area'})
-df_pred = df_pred.rename(columns={PREDCLASS_FIELD: 'Class', 'SUM_Shape_Area': 'Pred_Total_Area'})
+    def read_fc(fc, field):
+        gdb, layer = os.path.split(fc)
+        return gpd.read_file(gdb, layer=layer)[[field, "geometry"]]
+
+    gdf_seg = read_fc(SEG_FC, PRED_FIELD)
+    gdf_rlp = read_fc(RLP_FC, REF_CLASS_FIELD).to_crs(gdf_seg.crs)
+
+    i_seg, i_rlp = gdf_rlp.sindex.query(gdf_seg.geometry, predicate="intersects")
+    rlp_geoms = gdf_rlp.geometry.to_numpy()
+    shapely.prepare(rlp_geoms)   # reuse each RLP's edge index across its candidate segments
+    seg_g, rlp_g = gdf_seg.geometry.to_numpy()[i_seg], rlp_geoms[i_rlp]
+
+    inside = shapely.contains_properly(rlp_g, seg_g)
+    areas = shapely.area(seg_g)
+    areas[~inside] = shapely.area(shapely.intersection(seg_g[~inside], rlp_g[~inside]))
+    keep = areas > 0   # drop pairs that only touch along an edge
+
+    df_cm_raw = cm_area_table(gdf_rlp[REF_CLASS_FIELD].fillna("").to_numpy()[i_rlp[keep]],
+                              gdf_seg[PRED_FIELD].fillna("").to_numpy()[i_seg[keep]],
+                              areas[keep])
+    write_area_table(df_cm_raw, CM_TBL, [REFCLASS_FIELD, PREDCLASS_FIELD])
+else:
+    # ----- 1-3) Confusion-matrix areas without intersect geometry --------------
+    # Zones = segments grouped by predicted class; classes = reference class of the RLPs.
+    # Output rows are (pred, ref, AREA) for every overlapping combination.
+    safe_delete(TABINT_TBL)
+    arcpy.analysis.TabulateIntersection(SEG_FC, [PRED_FIELD], RLP_FC, TABINT_TBL, [REF_CLASS_FIELD])
+    df_tab = pd.DataFrame(arcpy.da.TableToNumPyArray(
+        TABINT_TBL, [PRED_FIELD, REF_CLASS_FIELD, 'AREA'],
+        null_value={PRED_FIELD: "", REF_CLASS_FIELD: ""}
+    ))
+    df_cm_raw = cm_area_table(df_tab[REF_CLASS_FIELD], df_tab[PRED_FIELD], df_tab['AREA'])
+    write_area_table(df_cm_raw, CM_TBL, [REFCLASS_FIELD, PREDCLASS_FIELD])
+
+# ----- 3b) Reference / predicted totals ------------------------------------
+# Marginals of the confusion-matrix areas (same sums as separate Statistics sweeps
+# of the intersect FC by RefClass and by <TAG>_PredClass)
+df_ref_raw = df_cm_raw.groupby(REFCLASS_FIELD, as_index=False)['SUM_Shape_Area'].sum()
+df_pred_raw = df_cm_raw.groupby(PREDCLASS_FIELD, as_index=False)['SUM_Shape_Area'].sum()
+write_area_table(df_ref_raw, REFTOTALS_TBL, [REFCLASS_FIELD])
+write_area_table(df_pred_raw, PREDTOTALS_TBL, [PREDCLASS_FIELD])
+
+# ----- 4) Build Per-Class Accuracy table -------------------------------------
+# Rename summary columns for clarity/consistency
+df_cm   = df_cm_raw.rename(columns={REFCLASS_FIELD: 'Ref', PREDCLASS_FIELD: 'Pred', 'SUM_Shape_Area': 'Area'})
+df_ref  = df_ref_raw.rename(columns={REFCLASS_FIELD: 'Class', 'SUM_Shape_Area': 'Ref_Total_Area'})
+df_pred = df_pred_raw.rename(columns={PREDCLASS_FIELD: 'Class', 'SUM_Shape_Area': 'Pred_Total_Area'})
 
 # Diagonal (correct) areas per class
 df_diag = df_cm[df_cm['Ref'] == df_cm['Pred']].copy()
@@ -135,19 +229,27 @@ for col in ['Correct_Area', 'Ref_Total_Area', 'Pred_Total_Area']:
 # F1                = 2 * (P * U) / (P + U)
 # FN_Area           = Ref_Total - Correct; FN_Prop = FN_Area / Ref_Total
 # FP_Area           = Pred_Total - Correct; FP_Prop = FP_Area / Pred_Total
+# Zero denominators give 0.0 (vectorized over all classes at once)
 def safe_div(a, b):
-    return (a / b) if (b and b != 0) else 0.0
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    return np.divide(a, b, out=np.zeros_like(a), where=(b != 0))
 
-df_metrics['Producer_Accuracy'] = [safe_div(c, r) for c, r in zip(df_metrics['Correct_Area'], df_metrics['Ref_Total_Area'])]
-df_metrics['User_Accuracy']     = [safe_div(c, p) for c, p in zip(df_metrics['Correct_Area'], df_metrics['Pred_Total_Area'])]
-df_metrics['IoU']               = [safe_div(c, (r + p - c)) for c, r, p in zip(df_metrics['Correct_Area'], df_metrics['Ref_Total_Area'], df_metrics['Pred_Total_Area'])]
-df_metrics['F1_Score']          = [safe_div(2*(pa*ua), (pa+ua)) if (pa+ua) != 0 else 0.0
-                                   for pa, ua in zip(df_metrics['Producer_Accuracy'], df_metrics['User_Accuracy'])]
+c = df_metrics['Correct_Area'].to_numpy(dtype=float)
+r = df_metrics['Ref_Total_Area'].to_numpy(dtype=float)
+p = df_metrics['Pred_Total_Area'].to_numpy(dtype=float)
 
-df_metrics['FN_Area'] = df_metrics['Ref_Total_Area']  - df_metrics['Correct_Area']
-df_metrics['FN_Prop'] = [safe_div(fn, r) for fn, r in zip(df_metrics['FN_Area'], df_metrics['Ref_Total_Area'])]
-df_metrics['FP_Area'] = df_metrics['Pred_Total_Area'] - df_metrics['Correct_Area']
-df_metrics['FP_Prop'] = [safe_div(fp, p) for fp, p in zip(df_metrics['FP_Area'], df_metrics['Pred_Total_Area'])]
+pa = safe_div(c, r)
+ua = safe_div(c, p)
+df_metrics['Producer_Accuracy'] = pa
+df_metrics['User_Accuracy']     = ua
+df_metrics['IoU']               = safe_div(c, r + p - c)
+df_metrics['F1_Score']          = safe_div(2 * pa * ua, pa + ua)
+
+df_metrics['FN_Area'] = r - c
+df_metrics['FN_Prop'] = safe_div(r - c, r)
+df_metrics['FP_Area'] = p - c
+df_metrics['FP_Prop'] = safe_div(p - c, p)
 
 # Round like prior outputs
 df_metrics = df_metrics.round({
@@ -164,20 +266,8 @@ df_out = df_metrics[['Class', 'Correct_Area', 'Ref_Total_Area', 'Pred_Total_Area
 
 # Write PerClass table
 safe_delete(PERCLASS_TBL)
-structured_array = np.array([(
-    row['Class'],
-    row['Correct_Area'],
-    row['Ref_Total_Area'],
-    row['Pred_Total_Area'],
-    row['FN_Area'],
-    row['FN_Prop'],
-    row['FP_Area'],
-    row['FP_Prop'],
-    row['Producer_Accuracy'],
-    row['User_Accuracy'],
-    row['IoU'],
-    row['F1_Score']
-) for _, row in df_out.iterrows()], dtype=[
+# Allocate with the target dtype and fill column by column (no per-row iteration)
+structured_array = np.empty(len(df_out), dtype=[
     ('Class', 'U50'),
     ('Correct_Area', 'f8'),
     ('Ref_Total_Area', 'f8'),
@@ -191,6 +281,8 @@ structured_array = np.array([(
     ('IoU', 'f8'),
     ('F1_Score', 'f8')
 ])
+for col in structured_array.dtype.names:
+    structured_array[col] = df_out[col].to_numpy()
 arcpy.da.NumPyArrayToTable(structured_array, PERCLASS_TBL)
 arcpy.AddMessage(f"Per-class accuracy written: {PERCLASS_TBL}")
 
@@ -205,8 +297,15 @@ safe_delete(OA_TBL)
 arcpy.da.NumPyArrayToTable(oa_array, OA_TBL)
 arcpy.AddMessage(f"Overall accuracy ({TAG}) = {round(overall_accuracy,4)}  → {OA_TBL}")
 
+# ----- 6) Optional confusion-matrix figure ---------------------------------
+if CM_PNG:
+    from accuracy_confusion_matrix import plot_cm
+    plot_cm(df_cm_raw, CM_PNG, pred_field=PREDCLASS_FIELD,
+            title=f"Confusion Matrix for the {TAG} Classification")
+    arcpy.AddMessage(f"Confusion matrix figure written: {CM_PNG}")
+
 print("✅ Accuracy workflow complete.")
-print(f"   • Intersect:        {INTERSECT_FC}")
+print(f"   • Intersect:        {INTERSECT_FC if WRITE_INTERSECT_FC else (TABINT_TBL if OVERLAY_ENGINE == 'ARCPY' else 'in memory (geopandas)')}")
 print(f"   • CM table:         {CM_TBL}")
 print(f"   • RefTotals table:  {REFTOTALS_TBL}")
 print(f"   • PredTotals table: {PREDTOTALS_TBL}")
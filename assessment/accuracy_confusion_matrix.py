@@ -12,6 +12,9 @@
 #        and inputs accordingly.
 #        Requires execution of the 1-pass accuracy assessment script first,
 #        which generates the tables that this script uses to plot results.
+#        The 1-pass script can also call plot_cm() directly with its
+#        in-memory table (see CM_PNG there); run this file standalone to
+#        plot from the saved GDB table.
 # Inputs: An ArcGIS confusion-matrix table containing RefClass, <PredField>,
 #         and SUM_Shape_Area fields. Update the file paths and predicted
 #         class field name as needed.
@@ -20,6 +23,7 @@
 # =============================================================================
 
 import arcpy
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -27,6 +31,7 @@ import matplotlib.pyplot as plt
 # === STEP 1: Define paths (EDIT THESE) ===
 conf_matrix_table = r"C:\path\to\Accuracy_Assessment.gdb\TrialRunXX_E5_CM_tbl"
 output_img_path   = r"C:\path\to\Outputs\TrialRunXX_E5_CM.png"
+PRED_CLASS_FIELD  = "E5_PredClass"   # predicted class field in the CM table (<TAG>_PredClass)
 
 # === STEP 2: Define class name abbreviation and order ===
 class_label_map = {
@@ -44,44 +49,64 @@ class_label_map = {
 label_order = ["WB", "SI-S", "SI-C", "R", "F", "SSU", "BSU-NS", "BSU-S", "IC", "VB"]
 
 # === STEP 3: Load confusion matrix table ===
-df_cm = pd.DataFrame(arcpy.da.TableToNumPyArray(
-    conf_matrix_table, ['RefClass', 'E5_PredClass', 'SUM_Shape_Area']
-))
-
-# === STEP 4: Apply label map to abbreviate class names ===
-df_cm['Ref_Label'] = df_cm['RefClass'].map(class_label_map)
-df_cm['Pred_Label'] = df_cm['E5_PredClass'].map(class_label_map)
-
-# === STEP 5: Pivot to confusion matrix and enforce schema order ===
-conf_matrix = pd.pivot_table(
-    df_cm, values='SUM_Shape_Area',
-    index='Ref_Label', columns='Pred_Label',
-    aggfunc='sum', fill_value=0
-).reindex(index=label_order, columns=label_order, fill_value=0)
-
-# === STEP 6: Normalize by row for interpretability ===
-conf_matrix_norm = conf_matrix.div(conf_matrix.sum(axis=1), axis=0).fillna(0)
-
-# === STEP 7: Plot confusion matrix ===
-plt.figure(figsize=(10, 9))
-sns.set(font_scale=1.1)
-ax = sns.heatmap(conf_matrix_norm, annot=True, fmt=".2f", cmap='Blues', cbar=True,
-                 linewidths=0.5, square=True, annot_kws={"size": 12})
-
-# === STEP 8: Format plot ====
-plt.title("Confusion Matrix for the E5 Ensemble Classification", fontsize=14, weight='bold', pad=20)
-plt.xlabel("Predicted Class", fontsize=12, labelpad=15)
-plt.ylabel("Reference Class", fontsize=12, labelpad=15)
-plt.xticks(rotation=45, ha='center', fontsize=12)
-plt.yticks(rotation=0, fontsize=12)
-
-# Set colorbar label
-cbar = ax.collections[0].colorbar
-cbar.ax.set_ylabel("Row-Normalized (%)", rotation=270, labelpad=15, fontsize=12)
-
-plt.tight_layout()
-
-# === STEP 9: Save figure to file ===
-plt.savefig(output_img_path, dpi=300)
-plt.close()
-print(f"✅ E5 Ensemble confusion matrix figure saved to:\n{output_img_path}")
\ No newline at end of file
+def load_cm_table(table_path, pred_field=PRED_CLASS_FIELD):
+    """Read the ArcGIS confusion-matrix table (standalone use only)."""
+    return pd.DataFrame(arcpy.da.TableToNumPyArray(
+        table_path, ['RefClass', pred_field, 'SUM_Shape_Area']
+    ))
+
+
+def plot_cm(df_cm, out_png, pred_field=PRED_CLASS_FIELD,
+            title="Confusion Matrix for the E5 Ensemble Classification"):
+    """
+    Plot a row-normalized confusion matrix from a DataFrame with RefClass,
+    <pred_field> and SUM_Shape_Area columns. The 1-pass accuracy script passes
+    its in-memory table directly, avoiding a re-read of the GDB table.
+    """
+    df_cm = df_cm.copy()
+
+    # === STEP 4: Apply label map to abbreviate class names ===
+    df_cm['Ref_Label'] = df_cm['RefClass'].map(class_label_map)
+    df_cm['Pred_Label'] = df_cm[pred_field].map(class_label_map)
+
+    # === STEP 5: Accumulate confusion matrix in schema order ===
+    # Category codes index straight into the matrix; unmapped labels (-1) are dropped.
+    ref_c = pd.Categorical(df_cm['Ref_Label'], categories=label_order).codes
+    pred_c = pd.Categorical(df_cm['Pred_Label'], categories=label_order).codes
+    mask = (ref_c >= 0) & (pred_c >= 0)
+    n_cls = len(label_order)
+    cm = np.zeros((n_cls, n_cls), dtype=np.float64)
+    np.add.at(cm, (ref_c[mask], pred_c[mask]),
+              df_cm['SUM_Shape_Area'].to_numpy(dtype=np.float64)[mask])
+    conf_matrix = pd.DataFrame(cm, index=label_order, columns=label_order)
+
+    # === STEP 6: Normalize by row for interpretability ===
+    conf_matrix_norm = conf_matrix.div(conf_matrix.sum(axis=1), axis=0).fillna(0)
+
+    # === STEP 7: Plot confusion matrix ===
+    plt.figure(figsize=(10, 9))
+    sns.set(font_scale=1.1)
+    ax = sns.heatmap(conf_matrix_norm, annot=True, fmt=".2f", cmap='Blues', cbar=True,
+                     linewidths=0.5, square=True, annot_kws={"size": 12})
+
+    # === STEP 8: Format plot ====
+    plt.title(title, fontsize=14, weight='bold', pad=20)
+    plt.xlabel("Predicted Class", fontsize=12, labelpad=15)
+    plt.ylabel("Reference Class", fontsize=12, labelpad=15)
+    plt.xticks(rotation=45, ha='center', fontsize=12)
+    plt.yticks(rotation=0, fontsize=12)
+
+    # Set colorbar label
+    cbar = ax.collections[0].colorbar
+    cbar.ax.set_ylabel("Row-Normalized (%)", rotation=270, labelpad=15, fontsize=12)
+
+    plt.tight_layout()
+
+    # === STEP 9: Save figure to file ===
+    plt.savefig(out_png, dpi=300)
+    plt.close()
+
+
+if __name__ == "__main__":
+    plot_cm(load_cm_table(conf_matrix_table), output_img_path)
+    print(f"✅ E5 Ensemble confusion matrix figure saved to:\n{output_img_path}")
@@ -0,0 +1 @@
+# Helpers shared by the scripts in this repository.
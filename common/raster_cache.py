@@ -0,0 +1,78 @@
+# ---------------------------------------------------------------------
+# Title: raster_cache.py
+# Author: Derek Robillard, with OpenAI assistance
+# Purpose: Shared helpers for the .npz statistics caches written by
+#          analysis/analyze_correlation.py and preprocessing/preprocess_tpi_automation.py.
+# Notes: Cache keys identify each input raster dataset by its own properties, not by
+#        folder timestamps: an FGDB raster shares its .gdb folder with other datasets
+#        (including outputs of the scripts themselves) and with the *.lock files ArcGIS
+#        writes whenever anything in the GDB is opened, so folder times change on every run.
+#        FGDB rasters have no per-dataset timestamp, and the sampled checksum used instead
+#        cannot see every edit; the caches are therefore opt-in in both scripts, with a
+#        user-set tag to bump whenever an input raster is regenerated.
+# Citation: Robillard (2025). *MGISA landform mapping scripts* [Computer software]. GitHub.
+# ---------------------------------------------------------------------
+
+import glob
+import hashlib
+import os
+import re
+
+import arcpy
+
+SAMPLE_EDGE = 64   # edge (cells) of each window sampled for the content checksum
+SAMPLE_GRID = 4    # windows sampled per axis (4 x 4, all inside the raster, none on its border)
+
+
+def sample_checksum(raster):
+    """MD5 of a few small interior windows of the raster (a cheap, partial content fingerprint)."""
+    ext = raster.extent
+    edge_r, edge_c = min(SAMPLE_EDGE, raster.height), min(SAMPLE_EDGE, raster.width)
+    h = hashlib.md5()
+    for i in range(1, SAMPLE_GRID + 1):
+        for j in range(1, SAMPLE_GRID + 1):
+            # window centres at i/(SAMPLE_GRID+1) of the height/width: clipped study-area
+            # rasters are mostly NoData along the border, so border windows prove nothing
+            r0 = min(max(raster.height * i // (SAMPLE_GRID + 1) - edge_r // 2, 0), raster.height - edge_r)
+            c0 = min(max(raster.width * j // (SAMPLE_GRID + 1) - edge_c // 2, 0), raster.width - edge_c)
+            lower_left = arcpy.Point(ext.XMin + c0 * raster.meanCellWidth,
+                                     ext.YMax - (r0 + edge_r) * raster.meanCellHeight)
+            h.update(arcpy.RasterToNumPyArray(raster, lower_left, edge_c, edge_r).tobytes())
+    return h.hexdigest()
+
+
+def raster_signature(path):
+    """
+    Identify one raster dataset for a cache key: path, rows/columns, extent, cell size,
+    spatial reference, pixel type and NoData, plus the file's modification time for
+    single-file rasters (e.g. GeoTIFF) or a sampled content checksum for FGDB rasters,
+    which have no per-dataset timestamp.
+    """
+    raster = arcpy.Raster(path)
+    ext = raster.extent
+    sr = raster.spatialReference
+    signature = [path, raster.height, raster.width,
+                 ext.XMin, ext.YMin, ext.XMax, ext.YMax,
+                 raster.meanCellWidth, raster.meanCellHeight,
+                 sr.factoryCode, sr.name, raster.pixelType, raster.noDataValue]
+    if os.path.isfile(path):
+        signature.append(os.path.getmtime(path))
+    else:
+        signature.append(sample_checksum(raster))
+    return signature
+
+
+def cache_path(folder, prefix, key_parts):
+    """
+    Path of the <prefix>_<hash>.npz cache for key_parts in folder. Caches with the same
+    prefix but another key are stale (their inputs changed) and are deleted.
+    """
+    key = hashlib.md5(repr(key_parts).encode()).hexdigest()
+    path = os.path.join(folder, f"{prefix}_{key}.npz")
+    # Only <prefix>_<32 hex>.npz: a longer prefix sharing this one (e.g. another variant
+    # name that starts the same way) is a different cache
+    stale = re.compile(re.escape(f"{prefix}_") + r"[0-9a-f]{32}\.npz$")
+    for old in glob.glob(os.path.join(folder, f"{prefix}_*.npz")):
+        if stale.match(os.path.basename(old)) and os.path.normcase(old) != os.path.normcase(path):
+            os.remove(old)
+    return path
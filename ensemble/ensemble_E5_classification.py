@@ -13,17 +13,25 @@
 #        This method could not be executed until after the accuracy
 #        assessments for the four ML classifiers were completed, since
 #        IoU metrics from those assessments are required for weighting.
+#        The report run used the zonal-mean elevation for the WATER BODY
+#        rule; set WB_ELEV_METHOD = "ZONAL_MEAN" to reproduce it exactly.
 # Inputs: Segment polygons with prediction fields for four classifiers,
 #         per-class IoU tables from the accuracy assessments, and a DEM
 #         for the WATER BODY elevation rule.
 # Outputs: Adds fields to the segment polygons for the ensemble class (E5),
-#          source classifiers (E5_src), and ensemble score (E5_score).
+#          source classifiers (E5_src, plus the E5_srcbits bitmask), and
+#          ensemble score (E5_score).
 # Citation: Robillard (2025). *MGISA landform mapping scripts* [Computer software]. GitHub.
 # =============================================================================
 
 import arcpy
-from collections import defaultdict
-import math
+import numpy as np
+import pandas as pd
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # =============================================================================
 # PARAMS — YOUR PROJECT SETTINGS
@@ -65,6 +73,7 @@ CLF_PRIORITY = ["SVMv11A2D60", "RTv11A2D60", "SVMv11A2D50", "RTv11A2D50"]
 E5_FIELD       = "E5"
 E5_SRC_FIELD   = "E5_src"
 E5_SCORE_FIELD = "E5_score"
+E5_SRCBITS_FIELD = "E5_srcbits"   # SHORT bitmask of E5_src (bit i = CLF_PRIORITY[i])
 E5_LEN = 50
 E5_SRC_LEN = 60
 
@@ -77,149 +86,248 @@ SVM_RIVER_CLF = "SVMv11A2D60"
 CLS_WATER = "WATER BODY"
 ELEV_RASTER = r"C:\path\to\DEMs\YourDEM.tif"
 ELEV_THRESH = 220.0  # meters
+# Elevation used by the rule: "CENTROID" samples the DEM at each candidate segment's
+# centroid (fast); "ZONAL_MEAN" uses the zonal mean, as in the report run.
+WB_ELEV_METHOD = "CENTROID"
+
+# (11) Optional: SEG_FC as a hosted/enterprise feature layer. Set SEG_FC to the layer
+#      URL as well; results are then sent with arcgis edit_features in batches
+#      (signed-in ArcGIS Pro portal). None = write with arcpy (file GDB).
+SEG_FC_URL = None
+EDIT_BATCH_SIZE = 2000
 
 # =============================================================================
 # END PARAMS -- NOTE: No changes to logic below this line
 # =============================================================================
 
+# Tie-break rank per classifier (dict lookup instead of list.index). The rank is also the
+# classifier's bit in E5_srcbits, so every classifier in CLASS_FIELDS must be ranked.
+PRIO_RANK = {clf: i for i, clf in enumerate(CLF_PRIORITY)}
+_unranked = sorted(set(CLASS_FIELDS) - set(CLF_PRIORITY))
+if _unranked:
+    raise ValueError(f"CLF_PRIORITY is missing classifier(s) from CLASS_FIELDS: {', '.join(_unranked)}")
+
+
+def decode_src(bitmask):
+    """E5_srcbits -> E5_src string (classifiers joined with "+" in priority order)."""
+    return "+".join(clf for i, clf in enumerate(CLF_PRIORITY) if (int(bitmask) >> i) & 1)
+
+
+# All 2^K provenance strings, indexed by bitmask
+SRC_LOOKUP = [decode_src(b) for b in range(1 << len(CLF_PRIORITY))]
+
 def ensure_fields(fc, fields_spec):
-    """Add any missing output fields (text length adjustable)."""
-    existing = {f.name.upper(): f for f in arcpy.ListFields(fc)}
+    """Add any missing output fields in one AddFields call (text length adjustable)."""
+    existing = {f.name.upper() for f in arcpy.ListFields(fc)}
+    missing = []
     for name, ftype, kwargs in fields_spec:
         if name.upper() not in existing:
-            arcpy.AddField_management(fc, name, ftype, **kwargs)
+            # AddFields row: [name, type, alias, length]
+            desc = [name, ftype, "", kwargs["field_length"]] if "field_length" in kwargs else [name, ftype]
+            missing.append(desc)
+    if missing:
+        arcpy.management.AddFields(fc, missing)
 
 
 def read_metric_table(tbl_path, metric_col, class_col="Class"):
-    """Return dict: class_name -> metric_value (float; NaN/missing => 0.0)."""
-    W = {}
-    with arcpy.da.SearchCursor(tbl_path, [class_col, metric_col]) as cur:
-        for cls, val in cur:
-            try:
-                v = float(val)
-                if math.isnan(v):
-                    v = 0.0
-            except Exception:
-                v = 0.0
-            W[str(cls)] = max(0.0, v)
-    return W
-
-
-def normalize_per_class(weight_map, power=1.0):
-    """Normalize weights per class so that the four classifier weights sum to 1."""
-    out = {}
-    for cls, clf_dict in weight_map.items():
-        powered = {clf: (w ** power if power != 1.0 else w) for clf, w in clf_dict.items()}
-        s = sum(powered.values())
-        if s > 0:
-            out[cls] = {clf: (w / s) for clf, w in powered.items()}
-        else:
-            out[cls] = {clf: 0.0 for clf in clf_dict.keys()}
-    return out
-
-def build_weight_dict(metric_col):
-    """Build normalized weights dict: Wnorm[class][clf] in [0..1]."""
-    W_rt50  = read_metric_table(TBL_RT_D50,  metric_col)
-    W_rt60  = read_metric_table(TBL_RT_D60,  metric_col)
-    W_svm50 = read_metric_table(TBL_SVM_D50, metric_col)
-    W_svm60 = read_metric_table(TBL_SVM_D60, metric_col)
-
-    all_classes = set(W_rt50) | set(W_rt60) | set(W_svm50) | set(W_svm60)
-
-    raw = {}
-    for cls in all_classes:
-        raw[cls] = {
-            "RTv11A2D50":  W_rt50.get(cls, 0.0),
-            "RTv11A2D60":  W_rt60.get(cls, 0.0),
-            "SVMv11A2D50": W_svm50.get(cls, 0.0),
-            "SVMv11A2D60": W_svm60.get(cls, 0.0),
-        }
-
-    return normalize_per_class(raw, power=WEIGHT_POWER)
-
-def maybe_export_weights_csv(Wnorm, out_csv):
+    """
+    Return dict: class_name -> metric_value (float; NaN/missing => 0.0). Rows with a
+    NULL or blank class are dropped: "" must stay the "no prediction" value.
+    """
+    arr = arcpy.da.TableToNumPyArray(tbl_path, [class_col, metric_col],
+                                     null_value={class_col: "", metric_col: np.nan})
+    arr = arr[arr[class_col] != ""]
+    vals = np.nan_to_num(arr[metric_col].astype(np.float64), nan=0.0)
+    return dict(zip(arr[class_col].astype(str).tolist(), np.clip(vals, 0.0, None).tolist()))
+
+
+def build_weight_matrix(metric_col):
+    """
+    Build normalized weights as a matrix: returns (weight_classes, W_mat) where
+    W_mat[c, k] in [0..1] is the weight of classifier k (CLASS_FIELDS order) for
+    weight_classes[c]; each row sums to 1 (or is all zero).
+    """
+    tables = {
+        "RTv11A2D50":  TBL_RT_D50,
+        "RTv11A2D60":  TBL_RT_D60,
+        "SVMv11A2D50": TBL_SVM_D50,
+        "SVMv11A2D60": TBL_SVM_D60,
+    }
+    per_clf = [read_metric_table(tables[clf], metric_col) for clf in CLASS_FIELDS]
+
+    weight_classes = sorted(set().union(*per_clf))
+    class_idx = {cls: i for i, cls in enumerate(weight_classes)}
+    W_mat = np.zeros((len(weight_classes), len(per_clf)), dtype=np.float64)
+    for k, W in enumerate(per_clf):
+        W_mat[[class_idx[c] for c in W], k] = list(W.values())
+
+    if WEIGHT_POWER != 1.0:
+        W_mat **= WEIGHT_POWER
+    s = W_mat.sum(axis=1, keepdims=True)
+    W_mat = np.divide(W_mat, s, out=np.zeros_like(W_mat), where=s > 0)
+    return weight_classes, W_mat
+
+def maybe_export_weights_csv(weight_classes, W_mat, out_csv):
     """Optional: export normalized weights for audit."""
     if not out_csv:
         return
     import csv
+    clf_keys = list(CLASS_FIELDS)
     fields = ["Class"] + list(CLF_PRIORITY) + ["Sum"]
     with open(out_csv, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         w.writerow(fields)
-        for cls, d in sorted(Wnorm.items()):
-            row = [cls] + [d.get(clf, 0.0) for clf in CLF_PRIORITY]
-            row.append(sum(d.values()))
+        for cls, wrow in zip(weight_classes, W_mat):
+            row = [cls] + [float(wrow[clf_keys.index(clf)]) for clf in CLF_PRIORITY]
+            row.append(float(wrow.sum()))
             w.writerow(row)
 
 
-def pick_ensemble_label(preds, Wnorm, clf_priority_order, use_lowconf=False, tau=0.55):
-    """Compute ensemble winner for one segment with tie-breakers and fallback."""
-    score = defaultdict(float)
-    voters_by_class = defaultdict(list)
+def encode_predictions(arr, classes):
+    """Return preds_int[N, K] class codes (columns in CLASS_FIELDS order; -1 = no prediction)."""
+    return np.column_stack([
+        pd.Categorical(arr[fld], categories=classes).codes
+        for fld in CLASS_FIELDS.values()
+    ]).astype(np.int32)
 
-    for clf, cls in preds.items():
-        if not cls:
-            continue
-        w = Wnorm.get(cls, {}).get(clf, 0.0)
-        score[cls] += w
-        voters_by_class[cls].append((clf, w))
 
-    if not score:
-        return (None, [], 0.0)
-
-    max_score = max(score.values())
-    winners = [c for c, s in score.items() if abs(s - max_score) < 1e-12]
-
-    if len(winners) == 1:
-        winner = winners[0]
-    else:
-        best_w = -1.0
-        tb1_candidates = []
-        for c in winners:
-            top_single = max((w for (_clf, w) in voters_by_class[c]), default=0.0)
-            if top_single > best_w + 1e-15:
-                best_w = top_single
-                tb1_candidates = [c]
-            elif abs(top_single - best_w) <= 1e-15:
-                tb1_candidates.append(c)
-        if len(tb1_candidates) == 1:
-            winner = tb1_candidates[0]
-        else:
-            def best_priority_rank_for_class(c):
-                voters = [clf for (clf, _w) in voters_by_class[c]]
-                ranks = [clf_priority_order.index(clf) for clf in voters if clf in clf_priority_order]
-                return min(ranks) if ranks else 999
-            ranked = sorted(tb1_candidates, key=lambda c: best_priority_rank_for_class(c))
-            winner = ranked[0]
-
-    if use_lowconf and max_score < tau:
-        voters = voters_by_class[winner]
-        if voters:
-            best_clf = max(voters, key=lambda t: t[1])[0]
-        else:
-            best_clf = clf_priority_order[0]
-        winner = preds.get(best_clf, winner)
-        max_score = sum(Wnorm.get(winner, {}).get(clf, 0.0)
-                        for clf, pred in preds.items() if pred == winner)
-
-    src = sorted(
-        [clf for clf, pred in preds.items() if pred == winner],
-        key=lambda c: clf_priority_order.index(c) if c in clf_priority_order else 999
-    )
-    return (winner, src, max_score)
+def vote_ensemble_numpy(preds_int, W_mat, prio_rank, use_lowconf=False, tau=0.55):
+    """
+    IoU-weighted vote for all segments at once, with the original tie-breaks.
+    W_mat[c, k] is the normalized weight of classifier k for class c; prio_rank[k]
+    is its tie-break rank. Returns (winner[N] codes, -1 = no votes; score[N];
+    score_mat[N, C] of per-class vote totals).
+    """
+    N, K = preds_int.shape
+    C = W_mat.shape[0]
+    rows = np.arange(N)
+    has_pred = preds_int >= 0
+    pc = np.where(has_pred, preds_int, 0)   # safe gather index for missing predictions
+
+    # Weight of each voter, gathered once (N, K) and reused by the vote and tie-break 1
+    Wk = np.where(has_pred, W_mat[pc, np.arange(K)], 0.0)
+
+    # Each classifier casts at most one vote per row, so (row, class) pairs are
+    # unique within a column and plain fancy indexing is a safe scatter-add.
+    score_mat = np.zeros((N, C), dtype=np.float64)
+    voted = np.zeros((N, C), dtype=bool)
+    for k in range(K):
+        r = np.nonzero(has_pred[:, k])[0]
+        score_mat[r, preds_int[r, k]] += Wk[r, k]
+        voted[r, preds_int[r, k]] = True
+
+    has_vote = voted.any(axis=1)
+    max_score = np.where(voted, score_mat, -np.inf).max(axis=1)
+    cand = voted & (np.abs(score_mat - max_score[:, None]) < 1e-12)
+
+    # Tie-break 1: class with the strongest single voter. A tied class survives if
+    # any of its voters matches the strongest voter weight among tied classes.
+    cand_voter = has_pred & cand[rows[:, None], pc]
+    best_w = np.where(cand_voter, Wk, -1.0).max(axis=1)
+    strong = cand_voter & (np.abs(Wk - best_w[:, None]) <= 1e-15)
+    keep = np.zeros((N, C), dtype=bool)
+    for k in range(K):
+        keep[rows, pc[:, k]] |= strong[:, k]
+
+    # Tie-break 2: class backed by the highest-priority classifier (any of its voters)
+    elig = has_pred & keep[rows[:, None], pc]
+    k_best = np.where(elig, prio_rank[None, :], np.iinfo(np.int32).max).argmin(axis=1)
+    winner = np.where(has_vote, preds_int[rows, k_best], -1)
+    score = np.where(has_vote, max_score, 0.0)
+
+    if use_lowconf:
+        # The fallback re-picks the winner's strongest voter, whose prediction is the
+        # winner itself; only the reported score becomes the winner's own vote total.
+        low = has_vote & (max_score < tau)
+        score[low] = score_mat[np.nonzero(low)[0], winner[low]]
+
+    return winner, score, score_mat
+
+
+# If Numba is installed, the vote runs as a compiled kernel that loops over segments in
+# parallel with small per-row buffers instead of (N, C) temporaries; same results.
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def vote_ensemble_numba(preds_int, W_mat, prio_rank, use_lowconf=False, tau=0.55):
+        N, K = preds_int.shape
+        C = W_mat.shape[0]
+        winner = np.full(N, -1, dtype=np.int64)
+        score = np.zeros(N, dtype=np.float64)
+        score_mat = np.zeros((N, C), dtype=np.float64)
+        for i in numba.prange(N):
+            voted = np.zeros(C, dtype=np.bool_)
+            top_single = np.zeros(C, dtype=np.float64)
+            best_rank = np.full(C, 999, dtype=np.int32)
+            for k in range(K):
+                c = preds_int[i, k]
+                if c >= 0:
+                    w = W_mat[c, k]
+                    score_mat[i, c] += w
+                    voted[c] = True
+                    if w > top_single[c]:
+                        top_single[c] = w
+                    if prio_rank[k] < best_rank[c]:
+                        best_rank[c] = prio_rank[k]
+
+            max_score = -np.inf
+            for c in range(C):
+                if voted[c] and score_mat[i, c] > max_score:
+                    max_score = score_mat[i, c]
+            if max_score == -np.inf:
+                continue
+
+            # Tie-break 1: strongest single voter among tied classes
+            best_w = -1.0
+            for c in range(C):
+                if voted[c] and abs(score_mat[i, c] - max_score) < 1e-12 and top_single[c] > best_w:
+                    best_w = top_single[c]
+            # Tie-break 2: highest-priority classifier (first class wins exact ties)
+            best_c = -1
+            best_r = np.iinfo(np.int32).max
+            for c in range(C):
+                if (voted[c] and abs(score_mat[i, c] - max_score) < 1e-12
+                        and abs(top_single[c] - best_w) <= 1e-15 and best_rank[c] < best_r):
+                    best_r = best_rank[c]
+                    best_c = c
+
+            winner[i] = best_c
+            if use_lowconf and max_score < tau:
+                score[i] = score_mat[i, best_c]
+            else:
+                score[i] = max_score
+        return winner, score, score_mat
+
+    vote_ensemble = vote_ensemble_numba
+else:
+    vote_ensemble = vote_ensemble_numpy
 
 
 # >>> WB-ELEV RULE: helper builds {OID: mean_elev} using ZonalStatisticsAsTable
-def build_mean_elev_by_oid(seg_fc, elev_raster):
+def build_mean_elev_by_oid(seg_fc, elev_raster, oids=None):
     """
     Returns dict {OID: mean_elev}. Writes the temp Zonal Stats table to a
     scratch workspace (more reliable than in_memory). Requires Spatial Analyst.
+    If oids is given, zonal stats run only on that subset of segments.
     """
     arcpy.CheckOutExtension("Spatial")
     from arcpy.sa import ZonalStatisticsAsTable  # noqa: F401
 
     oid_field = arcpy.Describe(seg_fc).OIDFieldName
 
+    zones = seg_fc
+    if oids is not None:
+        if len(oids) == 0:
+            return {}
+        # Select only the requested segments (IN lists chunked to stay under SQL length limits)
+        zones = arcpy.management.MakeFeatureLayer(seg_fc, "wb_candidates_lyr")[0]
+        oid_sql = arcpy.AddFieldDelimiters(seg_fc, oid_field)
+        ids = [str(int(o)) for o in oids]
+        for i in range(0, len(ids), 1000):
+            arcpy.management.SelectLayerByAttribute(
+                zones, "NEW_SELECTION" if i == 0 else "ADD_TO_SELECTION",
+                f"{oid_sql} IN ({','.join(ids[i:i + 1000])})"
+            )
+
     # Prefer scratch GDB; fall back gracefully if unset/not present
     scratch_ws = arcpy.env.scratchGDB
     if not scratch_ws or not arcpy.Exists(scratch_ws):
@@ -235,7 +343,7 @@ def build_mean_elev_by_oid(seg_fc, elev_raster):
 
     # Run Zonal Statistics as Table
     arcpy.sa.ZonalStatisticsAsTable(
-        in_zone_data=seg_fc,
+        in_zone_data=zones,
         zone_field=oid_field,
         in_value_raster=elev_raster,
         out_table=zs_tbl,
@@ -252,71 +360,191 @@ def build_mean_elev_by_oid(seg_fc, elev_raster):
     # Best-effort cleanup
     try:
         arcpy.Delete_management(zs_tbl)
+        if zones is not seg_fc:
+            arcpy.Delete_management(zones)
     except Exception:
         pass
 
     return elev_by_oid
 
+# >>> WB-ELEV RULE: cheaper alternative that samples the DEM at segment centroids
+def sample_elev_at_centroids(seg_fc, elev_raster, oids, block=4096):
+    """
+    Returns dict {OID: elevation at the segment centroid} for the given OIDs
+    (NaN outside the DEM or on NoData). Only DEM blocks containing a centroid
+    are read, so no zonal pass over the polygons is needed.
+    """
+    if len(oids) == 0:
+        return {}
+
+    ras = arcpy.Raster(elev_raster)
+    oid_field = arcpy.Describe(seg_fc).OIDFieldName
+    pts = arcpy.da.FeatureClassToNumPyArray(
+        seg_fc, [oid_field, "SHAPE@XY"], spatial_reference=ras.spatialReference
+    )
+    pts = pts[np.isin(pts[oid_field], oids)]
+    xy = pts["SHAPE@XY"]
+
+    # Centroid -> cell indices (row 0 = top of the DEM)
+    cw, ch = ras.meanCellWidth, ras.meanCellHeight
+    rows = np.floor((ras.extent.YMax - xy[:, 1]) / ch).astype(np.int64)
+    cols = np.floor((xy[:, 0] - ras.extent.XMin) / cw).astype(np.int64)
+    inside = (rows >= 0) & (rows < ras.height) & (cols >= 0) & (cols < ras.width)
+
+    # Group centroids by DEM block and read each touched block once
+    n_tile_cols = -(-ras.width // block)
+    tile = (rows // block) * n_tile_cols + cols // block
+    elev = np.full(len(pts), np.nan)
+    for t in np.unique(tile[inside]):
+        sel = inside & (tile == t)
+        r0, c0 = (t // n_tile_cols) * block, (t % n_tile_cols) * block
+        bh, bw = min(block, ras.height - r0), min(block, ras.width - c0)
+        lower_left = arcpy.Point(ras.extent.XMin + c0 * cw, ras.extent.YMax - (r0 + bh) * ch)
+        dem = arcpy.RasterToNumPyArray(ras, lower_left, bw, bh, nodata_to_value=np.nan)
+        elev[sel] = dem[rows[sel] - r0, cols[sel] - c0]
+
+    return dict(zip(pts[oid_field].tolist(), elev.tolist()))
+
+def read_predictions(seg_fc, oid_field):
+    """Bulk-read OIDs and the four prediction fields in one pass (nulls => "")."""
+    read_fields = list(CLASS_FIELDS.values())
+    return arcpy.da.FeatureClassToNumPyArray(
+        seg_fc, [oid_field] + read_fields,
+        null_value={f: "" for f in read_fields}
+    )
+
+
+def write_results_edit_features(layer_url, oids, winners, srcs, src_bits, scores, batch_size=2000):
+    """Send E5/E5_src/E5_score as batched attribute updates to a feature service layer."""
+    from arcgis.gis import GIS
+    from arcgis.features import FeatureLayer
+
+    fl = FeatureLayer(layer_url, gis=GIS("pro"))
+    oid_name = fl.properties.objectIdField
+    updates = [
+        {"attributes": {oid_name: int(o), E5_FIELD: w or None,
+                        E5_SRC_FIELD: s or None, E5_SRCBITS_FIELD: int(b),
+                        E5_SCORE_FIELD: float(sc)}}
+        for o, w, s, b, sc in zip(oids, winners, srcs, src_bits, scores)
+    ]
+    updated = 0
+    for i in range(0, len(updates), batch_size):
+        res = fl.edit_features(updates=updates[i:i + batch_size])
+        updated += sum(1 for r in res.get("updateResults", []) if r.get("success"))
+    return updated
+
+def write_results(seg_fc, oid_field, oids, winners, srcs, src_bits, scores):
+    """
+    Write E5/E5_src/E5_score back to seg_fc in one ExtendTable call, joined on
+    the OID. Falls back to an UpdateCursor on installs without ExtendTable.
+    Segments without a vote get NULL E5/E5_src on every path.
+    """
+    if hasattr(arcpy.da, "ExtendTable"):
+        out = np.empty(len(oids), dtype=[
+            ("SEG_OID", "i4"),
+            (E5_FIELD, f"U{E5_LEN}"),
+            (E5_SRC_FIELD, f"U{E5_SRC_LEN}"),
+            (E5_SRCBITS_FIELD, "i2"),
+            (E5_SCORE_FIELD, "f8"),
+        ])
+        out["SEG_OID"] = oids
+        out[E5_FIELD] = winners
+        out[E5_SRC_FIELD] = srcs
+        out[E5_SRCBITS_FIELD] = src_bits
+        out[E5_SCORE_FIELD] = scores
+        arcpy.da.ExtendTable(seg_fc, oid_field, out, "SEG_OID", append_only=False)
+        # Text arrays cannot hold NULL, so no-vote segments were written as "";
+        # reset just those rows (usually none) to NULL.
+        if (out[E5_FIELD] == "").any() or (out[E5_SRC_FIELD] == "").any():
+            where = " OR ".join(f"{arcpy.AddFieldDelimiters(seg_fc, f)} = ''"
+                                for f in (E5_FIELD, E5_SRC_FIELD))
+            with arcpy.da.UpdateCursor(seg_fc, [E5_FIELD, E5_SRC_FIELD], where) as ucur:
+                for w, src in ucur:
+                    ucur.updateRow([w or None, src or None])
+        return len(out)
+
+    results = {int(o): (w or None, s or None, int(b), float(sc))
+               for o, w, s, b, sc in zip(oids, winners, srcs, src_bits, scores)}
+    updated = 0
+    with arcpy.da.UpdateCursor(seg_fc, [oid_field, E5_FIELD, E5_SRC_FIELD, E5_SRCBITS_FIELD,
+                                       E5_SCORE_FIELD]) as ucur:
+        for row in ucur:
+            if row[0] in results:
+                ucur.updateRow([row[0], *results[row[0]]])
+                updated += 1
+    return updated
+
 def main():
     ensure_fields(
         SEG_FC,
         [
             (E5_FIELD, "TEXT", {"field_length": E5_LEN}),
             (E5_SRC_FIELD, "TEXT", {"field_length": E5_SRC_LEN}),
+            (E5_SRCBITS_FIELD, "SHORT", {}),
             (E5_SCORE_FIELD, "DOUBLE", {}),
         ],
     )
 
-    Wnorm = build_weight_dict(WEIGHT_METRIC_COL)
+    weight_classes, W_norm = build_weight_matrix(WEIGHT_METRIC_COL)
     if EXPORT_WEIGHTS_CSV:
-        maybe_export_weights_csv(Wnorm, EXPORT_WEIGHTS_CSV)
+        maybe_export_weights_csv(weight_classes, W_norm, EXPORT_WEIGHTS_CSV)
 
-    # >>> WB-ELEV RULE: precompute mean elevation per segment (once)
-    elev_by_oid = {}
     oid_field = arcpy.Describe(SEG_FC).OIDFieldName
-    if ENABLE_WB_ELEV_RULE:
-        elev_by_oid = build_mean_elev_by_oid(SEG_FC, ELEV_RASTER)
+    clf_keys = list(CLASS_FIELDS)
 
-    read_fields = list(CLASS_FIELDS.values())
-    write_fields = [E5_FIELD, E5_SRC_FIELD, E5_SCORE_FIELD]
+    # Read OID + predictions once; results are written back in a single ExtendTable call
+    arr = read_predictions(SEG_FC, oid_field)
+    oids = arr[oid_field]
 
-    clf_priority_order = list(CLF_PRIORITY)
-
-    n = 0
-    updated = 0
-    # >>> include OID at the front so we can look up mean elevation quickly
-    with arcpy.da.UpdateCursor(SEG_FC, [oid_field] + read_fields + write_fields) as ucur:
-        for row in ucur:
-            n += 1
-            oid = row[0]
-            preds_vals = row[1:1+len(read_fields)]
-            preds = {}
-            for (clf_key, fld), val in zip(CLASS_FIELDS.items(), preds_vals):
-                preds[clf_key] = None if val in (None, "",) else str(val)
-            preds = {k: v for k, v in preds.items() if v}
-
-            winner, src_clfs, score = pick_ensemble_label(
-                preds, Wnorm, clf_priority_order,
-                use_lowconf=USE_LOWCONF_FALLBACK, tau=TAU
-            )
+    # >>> WB-ELEV RULE: elevation only for segments the rule can affect
+    # (SVM_RIVER_CLF predicts WATER BODY); all other segments are skipped.
+    elev_by_oid = {}
+    if ENABLE_WB_ELEV_RULE:
+        wb_oids = oids[arr[CLASS_FIELDS[SVM_RIVER_CLF]] == CLS_WATER]
+        if WB_ELEV_METHOD == "ZONAL_MEAN":
+            elev_by_oid = build_mean_elev_by_oid(SEG_FC, ELEV_RASTER, oids=wb_oids)
+        else:
+            elev_by_oid = sample_elev_at_centroids(SEG_FC, ELEV_RASTER, wb_oids)
+    n = len(arr)
+
+    # Integer-encode classes and weights: preds_int[N, K], W_mat[C, K]
+    predicted = set()
+    for fld in CLASS_FIELDS.values():
+        predicted.update(np.unique(arr[fld]).tolist())
+    predicted.discard("")
+    classes = sorted(set(weight_classes) | predicted)
+    preds_int = encode_predictions(arr, classes)
+    # Classes predicted but absent from the weight tables get zero weight
+    W_mat = np.zeros((len(classes), len(clf_keys)), dtype=np.float64)
+    W_mat[[classes.index(c) for c in weight_classes]] = W_norm
+    prio_rank = np.array([PRIO_RANK[c] for c in clf_keys], dtype=np.int32)
+
+    winner, scores, score_mat = vote_ensemble(
+        preds_int, W_mat, prio_rank,
+        use_lowconf=USE_LOWCONF_FALLBACK, tau=TAU
+    )
 
-            # >>> WB-ELEV RULE: one-directional override to WATER BODY
-            if ENABLE_WB_ELEV_RULE:
-                mean_z = elev_by_oid.get(oid, None)
-                if (mean_z is not None) and (mean_z <= ELEV_THRESH):
-                    if preds.get(SVM_RIVER_CLF) == CLS_WATER:
-                        winner = CLS_WATER
-                        # provenance: list all voters that predicted WATER BODY
-                        src_clfs = sorted([clf for clf, cls in preds.items() if cls == CLS_WATER],
-                                          key=lambda c: clf_priority_order.index(c) if c in clf_priority_order else 999)
-                        score = sum(Wnorm.get(CLS_WATER, {}).get(clf, 0.0)
-                                    for clf, pred in preds.items() if pred == CLS_WATER)
-
-            row[1+len(read_fields) + 0] = winner if winner else None
-            row[1+len(read_fields) + 1] = "+".join(src_clfs) if src_clfs else None
-            row[1+len(read_fields) + 2] = float(score) if score is not None else None
-            ucur.updateRow(row)
-            updated += 1
+    # >>> WB-ELEV RULE: one-directional override to WATER BODY
+    if ENABLE_WB_ELEV_RULE and CLS_WATER in classes:
+        wb_code = classes.index(CLS_WATER)
+        mean_z = np.array([elev_by_oid.get(int(o)) for o in oids], dtype=np.float64)
+        wb = (mean_z <= ELEV_THRESH) & (preds_int[:, clf_keys.index(SVM_RIVER_CLF)] == wb_code)
+        winner[wb] = wb_code
+        # score: summed weight of all voters that predicted WATER BODY
+        scores[wb] = score_mat[wb, wb_code]
+
+    # Provenance: voters that predicted the final winner, in priority order
+    # (bit = priority position, so decoding yields priority order without a sort)
+    src_mask = (preds_int == winner[:, None]) & (winner[:, None] >= 0)
+    src_bits = (src_mask * (1 << prio_rank)[None, :]).sum(axis=1).astype(np.int16)
+    srcs = np.array(SRC_LOOKUP)[src_bits]
+    winners = np.array(classes + [""])[winner]
+
+    if SEG_FC_URL:
+        updated = write_results_edit_features(SEG_FC_URL, oids, winners, srcs, src_bits, scores,
+                                              batch_size=EDIT_BATCH_SIZE)
+    else:
+        updated = write_results(SEG_FC, oid_field, oids, winners, srcs, src_bits, scores)
 
     arcpy.AddMessage(f"E5 ensemble complete. Rows processed: {n}, updated: {updated}")
 
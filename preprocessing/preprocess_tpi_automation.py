@@ -1,17 +1,58 @@
 # Title: preprocess_tpi_automation.py  (original: Automate_TPI_Processing_MimicGPworkflow_20250618.py)
 # Author: Derek Robillard, with OpenAI assistance
 # Purpose: Automates Topographic Position Index (TPI) processing steps:
-#          (1) DEM - LocalMean → TPI, (2) clamp to ±2σ, (3) normalize to 0–255,
-#          and (4) save intermediate and final rasters using a consistent naming scheme.
-# Notes: Snapshot of the exact script used for the MGISA final report.
-#        Logic unchanged; only file paths and dataset names generalized.
+#          (1) DEM - LocalMean → TPI, (2) clamp to ±2σ, (3) normalize to the 0–255
+#          scale, and (4) save the final raster using a consistent naming scheme.
+#          By default the result is stored as 8-bit: values rounded and clipped to
+#          0–254, with 255 reserved for NoData.
+# Notes: Derived from the script used for the MGISA final report; file paths and dataset
+#        names generalized. The report run wrote a 32-bit float normalized raster (plus
+#        the TPI and clamped TPI) to the GDB; to reproduce it, set output_uint8 = False,
+#        output_format = "FGDB" and keep_intermediate = True.
 # Inputs: Update the placeholder paths below (DEM, local mean raster, output GDB).
-# Outputs: TPI raster, clamped TPI raster, and normalized TPI raster (float).
+# Outputs: Normalized TPI raster (8-bit by default, or float) in the output GDB, or as a
+#          Cloud-Optimized GeoTIFF. The TPI and clamped TPI are computed block-by-block
+#          in memory and only saved (compressed, float) with keep_intermediate = True.
+#          With use_stats_cache = True, tpi_stats_<variant>_<hash>.npz next to the output
+#          GDB caches the TPI statistics for reruns on the same inputs.
 # Citation: Robillard (2025). *MGISA landform mapping scripts* [Computer software]. GitHub.
 
-import arcpy
 import os
 
+# GDAL settings must be in the environment before arcpy (and its GDAL) loads; worker
+# processes re-import this module, so they get the same settings. A larger block cache
+# keeps decompressed source tiles between reads, and READDIR_ON_OPEN=TRUE skips listing
+# the (large) raster folder on every open while still probing sidecar files by name.
+os.environ.setdefault("GDAL_CACHEMAX", "1024")                 # MB
+os.environ.setdefault("GDAL_DISABLE_READDIR_ON_OPEN", "TRUE")
+
+import arcpy
+import math
+import numpy as np
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Shared helpers (common/) live one folder up from this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.raster_cache import cache_path, raster_signature
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    from osgeo import gdal   # bundled with ArcGIS Pro
+except ImportError:
+    gdal = None
+
 # === Set Environment Settings ===
 arcpy.env.overwriteOutput = True
 
@@ -30,60 +71,518 @@ output_gdb = r"C:\path\to\Derived_Rasters\TPI.gdb"                       # outpu
 # Variant label for output naming (e.g., '50m' or '5m_30m_Annulus')
 variant_name = "5m_30m_Annulus"  # modify as needed
 
+# Output pixel type of the normalized raster:
+#   True  = 8-bit unsigned (values rounded and clipped to 0–254; 255 = NoData)
+#   False = 32-bit float, as in the report run
+output_uint8 = True
+NODATA_U8 = 255
+
+# Output format of the normalized raster:
+#   "FGDB" = raster in output_gdb, as in the report run
+#   "COG"  = Cloud-Optimized GeoTIFF in output_folder (512x512 tiles, DEFLATE, overviews);
+#            smaller, and readers can fetch sub-windows without decoding the whole raster
+output_format = "FGDB"
+output_folder = r"C:\path\to\Derived_Rasters\TPI_COG"   # used only when output_format = "COG"
+
+# Save the TPI and clamped TPI rasters as well (float32, compressed: LZ77 in the GDB,
+# DEFLATE as COG). Off by default: nothing downstream reads them, and skipping them saves
+# two float rasters of disk I/O.
+keep_intermediate = False
+
+# Optional statistics cache (off by default). When on, the TPI statistics of passes 1 and 2
+# are saved as tpi_stats_<variant_name>_<hash>.npz next to the output GDB and reused on
+# reruns with unchanged inputs. FGDB rasters are only partly checked for changes (grid
+# properties + sampled windows), so change stats_cache_tag (any text, e.g. a date)
+# whenever the DEM or local mean is regenerated.
+use_stats_cache = False
+stats_cache_tag = ""
+
+# Pass 1 writes the TPI into a raw float32 scratch file (4 bytes per cell, in the scratch
+# folder) that passes 2 and 3 read back through np.memmap: the DEM and local mean are then
+# decoded once instead of three times, and repeated reads come from the OS page cache.
+# Set to False to recompute the TPI from the two rasters in every pass (no scratch file).
+use_memmap = True
+
+# Number of blocks processed concurrently (each worker is a separate ArcPy process that
+# reads its own blocks and writes its own tiles). Set to 1 to run sequentially.
+max_workers = min(4, os.cpu_count() or 1)
+
 # === Output Paths ===
 # Dataset names are generalized (no study-area prefix). Adjust if you prefer a different naming style.
+# Only normalized_raster is written unless keep_intermediate is set; the other two names
+# also define its naming scheme.
 tpi_raster = os.path.join(output_gdb, f"TPI_{variant_name}")
 clamped_raster = os.path.join(output_gdb, f"{tpi_raster}_2Sclamp")
 normalized_raster = os.path.join(output_gdb, f"{clamped_raster}_norm255")
+if output_format == "COG":
+    tpi_raster, clamped_raster, normalized_raster = (
+        os.path.join(output_folder, os.path.basename(path) + ".tif")
+        for path in (tpi_raster, clamped_raster, normalized_raster)
+    )
+
+# === Block Processing Helpers ===
+# The DEM and local mean are streamed block-by-block with RasterToNumPyArray() on the
+# DEM's grid (the local mean is a focal statistic of the DEM under the same snap raster
+# and cell size, so both share that grid). Result blocks are saved as temporary tiles
+# in the scratch folder and mosaicked once into the output raster.
+# Blocks are square, sized from a memory budget and rounded to a multiple of 512 cells so
+# they line up with the source rasters' internal tiles (FGDB 128x128, GeoTIFF 256/512):
+# every read then covers whole source tiles and no tile is decompressed for two blocks.
+block_mem_mb = 256          # working memory per block; lower this if memory is tight
+BYTES_PER_CELL = 16         # DEM + local mean + output float32 buffers, plus the 8-bit tile
+TILE_ALIGN = 512
+_edge = int(math.sqrt(block_mem_mb * 2**20 / BYTES_PER_CELL)) // TILE_ALIGN * TILE_ALIGN
+block_size = (max(_edge, TILE_ALIGN),) * 2  # (rows, cols) per block
+# Rasters written here (block tiles, mosaic, COG) use the same 512x512 internal tiles, so
+# every block covers whole output tiles and no tile is written partially and then
+# rewritten (the FGDB default is 128x128).
+arcpy.env.tileSize = f"{TILE_ALIGN} {TILE_ALIGN}"
+
+# Grid properties are read once here (each access is a call into ArcGIS) and kept as plain
+# numbers; statistics never come from the rasters (no GetRasterProperties / Raster.mean),
+# they are accumulated from the blocks in passes 1 and 2.
+dem_ras = arcpy.Raster(dem)
+mean_ras = arcpy.Raster(local_mean)
+dem_extent = dem_ras.extent
+n_rows, n_cols = dem_ras.height, dem_ras.width
+cell_w, cell_h = dem_ras.meanCellWidth, dem_ras.meanCellHeight
+x_min, y_max = dem_extent.XMin, dem_extent.YMax
+NODATA_F32 = float(np.finfo(np.float32).min)   # NoData marker for float32 tiles
+
+# Every run works in its own folder under the scratch folder (named after the variant,
+# made unique per run), holding the TPI scratch file and the block tiles; main() removes
+# it when the run ends, also on failure. Pool workers each write their tiles into a
+# private subfolder that is also their scratch workspace: concurrent ArcPy processes
+# sharing one scratch workspace run into lock and "already exists" errors.
+run_dir = None       # this run's folder (set by main() and in pool workers)
+tpi_scratch = None   # TPI scratch file in run_dir
+tile_dir = None      # where this process saves its tiles
+
+
+def set_run_dir(path):
+    """Point the run folder, TPI scratch file and tile folder of this process at path."""
+    global run_dir, tpi_scratch, tile_dir
+    run_dir = path
+    tpi_scratch = os.path.join(path, "tpi.f32")
+    tile_dir = path
+
+
+def tile_iter(block=block_size):
+    """Yield (row_off, col_off, n_block_rows, n_block_cols) covering the DEM grid."""
+    for r0 in range(0, n_rows, block[0]):
+        for c0 in range(0, n_cols, block[1]):
+            yield r0, c0, min(block[0], n_rows - r0), min(block[1], n_cols - c0)
+
+
+def block_lower_left(r0, c0, bh):
+    """Lower-left corner of a block (offsets counted from the upper-left cell)."""
+    return arcpy.Point(x_min + c0 * cell_w, y_max - (r0 + bh) * cell_h)
+
+
+# Blocks are read with GDAL's ReadAsArray (a direct band read, no geoprocessing call per
+# block) when the osgeo bindings are available and the DEM and local mean are raster files
+# on exactly the same grid; FGDB rasters and other cases go through RasterToNumPyArray.
+def gdal_same_grid(paths):
+    """True if GDAL can open every path and all share one size and geotransform."""
+    if gdal is None or any(".gdb" in path.lower() for path in paths):
+        return False
+    grids = set()
+    for path in paths:
+        ds = gdal.Open(path, gdal.GA_ReadOnly)
+        if ds is None:
+            return False
+        grids.add((ds.RasterXSize, ds.RasterYSize, ds.GetGeoTransform()))
+    return len(grids) == 1
+
+
+use_gdal = gdal_same_grid([dem, local_mean])
+_gdal_bands = {}   # id(raster) -> (dataset, band 1, NoData), opened once per process
+
+
+def gdal_band(raster):
+    """(band 1, NoData value) of an arcpy raster's file opened with GDAL (kept open)."""
+    key = id(raster)
+    if key not in _gdal_bands:
+        ds = gdal.Open(raster.catalogPath, gdal.GA_ReadOnly)
+        band = ds.GetRasterBand(1)
+        _gdal_bands[key] = (ds, band, band.GetNoDataValue())
+    return _gdal_bands[key][1:]
+
+
+def read_block(raster, r0, c0, bh, bw):
+    """Read one block as float32 with NoData as NaN."""
+    if use_gdal:
+        band, nodata = gdal_band(raster)
+        arr = band.ReadAsArray(c0, r0, bw, bh).astype(np.float32, copy=False)
+        if nodata is not None:
+            arr[arr == np.float32(nodata)] = np.nan
+        return arr
+    arr = arcpy.RasterToNumPyArray(raster, block_lower_left(r0, c0, bh), bw, bh,
+                                   nodata_to_value=np.nan)
+    return arr.astype(np.float32, copy=False)
+
+
+def open_tpi_scratch(mode="r"):
+    """Memory-map the TPI scratch file as an (n_rows, n_cols) float32 array."""
+    return np.memmap(tpi_scratch, dtype=np.float32, mode=mode, shape=(n_rows, n_cols))
+
+
+# The TPI statistics (passes 1 and 2) only change when the inputs or the processing grid
+# do, so with use_stats_cache they are cached next to the output GDB, keyed by
+# stats_cache_tag, each input raster's own signature (not the times of its .gdb folder,
+# which this script writes to; see common/raster_cache.py) and the grid settings. Reruns
+# (e.g. switching output format or pixel type) go straight to pass 3. A cache left by
+# earlier inputs of the same variant is replaced; other variants keep theirs.
+def stats_cache_path():
+    """Path of the .npz statistics cache for the current variant, inputs and grid."""
+    return cache_path(
+        os.path.dirname(output_gdb), f"tpi_stats_{variant_name}",
+        [stats_cache_tag] + [raster_signature(path) for path in (dem, local_mean)]
+        + [str(arcpy.env.extent), str(arcpy.env.cellSize), arcpy.env.outputCoordinateSystem.factoryCode]
+    )
+
+
+def save_tile(arr, r0, c0, idx, prefix):
+    """
+    Save one output block as a temporary tile; returns its path. uint8 blocks already
+    carry NODATA_U8; float32 blocks carry NaN, which is swapped for NODATA_F32.
+    """
+    if arr.dtype == np.uint8:
+        out, nodata = arr, NODATA_U8
+    else:
+        out, nodata = np.where(np.isnan(arr), NODATA_F32, arr), NODATA_F32
+    tile = arcpy.NumPyArrayToRaster(out, block_lower_left(r0, c0, arr.shape[0]),
+                                    cell_w, cell_h, value_to_nodata=nodata)
+    path = os.path.join(tile_dir, f"{prefix}_{idx}.tif")
+    tile.save(path)
+    return path
+
+
+def mosaic_tiles(tile_paths, out_raster, pixel_type="32_BIT_FLOAT"):
+    """Mosaic the temporary tiles into out_raster, then delete them."""
+    arcpy.management.MosaicToNewRaster(
+        ";".join(tile_paths), os.path.dirname(out_raster), os.path.basename(out_raster),
+        None, pixel_type, cell_w, 1, "FIRST", "FIRST"
+    )
+    if pixel_type == "8_BIT_UNSIGNED":
+        arcpy.management.SetRasterProperties(out_raster, nodata=f"1 {NODATA_U8}")
+    for path in tile_paths:
+        arcpy.management.Delete(path)
+
+def write_cog(src_raster, out_tif):
+    """Copy src_raster to a Cloud-Optimized GeoTIFF (tiled, DEFLATE, with overviews), then delete it."""
+    with arcpy.EnvManager(compression="DEFLATE", pyramid="PYRAMIDS -1 BILINEAR"):
+        arcpy.management.CopyRaster(src_raster, out_tif, format="COG")
+    arcpy.management.Delete(src_raster)
+
+
+def write_output(tile_paths, out_raster, pixel_type):
+    """Mosaic the tiles into out_raster, via a scratch mosaic + COG copy if output_format = "COG"."""
+    if output_format == "COG":
+        mosaic = os.path.join(run_dir, os.path.splitext(os.path.basename(out_raster))[0] + "_mosaic.tif")
+        mosaic_tiles(tile_paths, mosaic, pixel_type=pixel_type)
+        write_cog(mosaic, out_raster)
+    else:
+        mosaic_tiles(tile_paths, out_raster, pixel_type=pixel_type)
+
+# === Block Computations ===
+# Steps 1-3 run as fused block passes: pass 1 computes the TPI from the DEM and local
+# mean blocks, later passes take it from the scratch memmap (or recompute it), and only
+# the final normalized raster is written as a raster (no TPI or clamped intermediates,
+# no statistics scans).
+def tpi_block(r0, c0, bh, bw, cached=False):
+    """
+    TPI for one block (DEM - local mean), float32 with NoData as NaN. With cached=True
+    the block is copied out of the TPI scratch memmap written by pass 1.
+    """
+    if cached:
+        return np.array(open_tpi_scratch("r")[r0:r0 + bh, c0:c0 + bw])
+    t = read_block(dem_ras, r0, c0, bh, bw)
+    np.subtract(t, read_block(mean_ras, r0, c0, bh, bw), out=t)
+    return t
+
+
+# Statistics are accumulated as (count, mean, M2 = sum of squared deviations) per block
+# and merged with the Welford/Chan update, which stays numerically stable where a
+# running sum of squares would cancel.
+def block_moments(v):
+    """(count, mean, M2) of the valid values of one block."""
+    if v.size == 0:
+        return 0, 0.0, 0.0
+    m = v.mean(dtype=np.float64)
+    d = np.subtract(v, m, dtype=np.float64)
+    return v.size, float(m), float(np.dot(d, d))
+
+
+def merge_moments(a, b):
+    """Merge two (count, mean, M2) triples."""
+    n_a, m_a, M2_a = a
+    n_b, m_b, M2_b = b
+    n = n_a + n_b
+    if n_b == 0:
+        return a
+    delta = m_b - m_a
+    return n, m_a + delta * n_b / n, M2_a + M2_b + delta * delta * n_a * n_b / n
+
+
+def population_stats(acc):
+    """Population mean/std of a (count, mean, M2) triple (same definition as GetRasterProperties)."""
+    n, m, M2 = acc
+    return m, math.sqrt(M2 / n)
+
+
+# Clamp and normalize are fused per block. If Numba is installed this runs as a compiled
+# multi-threaded loop with no temporaries; else, if numexpr is installed, as one fused
+# multi-threaded expression; otherwise as in-place NumPy ufuncs (same result). Every
+# kernel overwrites its (C-contiguous) input block and returns it.
+# The normalization ((v - mean) / (2 * stddev)) * 127.5 + 127.5 is folded into v * k + b
+# (k = 127.5 / (2 * stddev), b = 127.5 - mean * k, computed once in main()), so each cell
+# costs one multiply-add instead of subtract, divide, multiply and add.
+def normalize_block_numpy(t, lo, hi, k, b):
+    """clip(t, lo, hi) * k + b, in place, NaN (NoData) preserved."""
+    np.clip(t, lo, hi, out=t)
+    t *= k
+    t += b
+    return t
+
+
+if numba is not None:
+    # The loop runs over the flattened block (so it also takes the 1-D array of valid cells
+    # from process_tile) and is kept SIMD-friendly: all constants are float32 (so it vectorizes
+    # over 8-lane float32 registers instead of widening to float64), the clamp is a pair of
+    # selects, and "contract" lets LLVM turn the multiply-add into one FMA instruction.
+    # Full fastmath is avoided because it assumes no NaNs (NaN carries NoData here).
+    @numba.njit(parallel=True, cache=True, fastmath={"contract"})
+    def normalize_block_numba(t, lo, hi, k, b):
+        """clip(t, lo, hi) * k + b, in place, NaN (NoData) preserved."""
+        lo32 = np.float32(lo)
+        hi32 = np.float32(hi)
+        k32 = np.float32(k)
+        b32 = np.float32(b)
+        flat = t.reshape(-1)   # a view: t is C-contiguous
+        for i in numba.prange(flat.size):
+            v = flat[i]   # NaN fails both tests below and stays NaN
+            v = lo32 if v < lo32 else v
+            v = hi32 if v > hi32 else v
+            flat[i] = v * k32 + b32
+        return t
+
+    normalize_block = normalize_block_numba
+elif numexpr is not None:
+    def normalize_block_numexpr(t, lo, hi, k, b):
+        """clip(t, lo, hi) * k + b as one numexpr evaluation, in place, NaN preserved."""
+        # float32 constants keep the expression in float32 (Python floats would upcast it)
+        consts = {name: np.float32(v) for name, v in (("lo", lo), ("hi", hi), ("k", k), ("b", b))}
+        return numexpr.evaluate("where(t < lo, lo, where(t > hi, hi, t)) * k + b",
+                                local_dict=dict(consts, t=t), out=t)
+
+    normalize_block = normalize_block_numexpr
+else:
+    normalize_block = normalize_block_numpy
+
+
+# === Per-Block Work Units ===
+# Blocks are independent once the local mean exists, so each pass maps one of these
+# functions over all blocks, in a process pool when max_workers > 1. Workers return
+# only small results (moments, tail sums, tile paths).
+def pass1_block(blk):
+    """
+    Pass 1: ((count, mean, M2), min, max) of the TPI in one block; stores the block in
+    the scratch memmap.
+    """
+    r0, c0, bh, bw = blk
+    t = tpi_block(*blk)
+    if use_memmap:
+        mm = open_tpi_scratch("r+")
+        mm[r0:r0 + bh, c0:c0 + bw] = t
+        mm.flush()
+        del mm
+    v = t[~np.isnan(t)]
+    if v.size == 0:
+        return block_moments(v), np.inf, -np.inf
+    return block_moments(v), float(v.min()), float(v.max())
+
+
+def pass2_block(args):
+    """Pass 2: tail counts and (value - mean) sums for the cells outside the clamp limits."""
+    blk, mean, lower_limit, upper_limit = args
+    t = tpi_block(*blk, cached=use_memmap)
+    d_lo = np.subtract(t[t < lower_limit], mean, dtype=np.float64)   # NaN never matches
+    d_hi = np.subtract(t[t > upper_limit], mean, dtype=np.float64)
+    return (d_lo.size, d_hi.size, d_lo.sum() + d_hi.sum(),
+            np.dot(d_lo, d_lo) + np.dot(d_hi, d_hi))
+
+
+def quantize_u8(values):
+    """Round/clip normalized (valid) values to 8-bit, 0–254."""
+    return np.clip(np.rint(values), 0, NODATA_U8 - 1).astype(np.uint8)
+
+
+def process_tile(tpi_arr, lower_limit, upper_limit, k, b):
+    """
+    TPI block -> final output block (uint8 or float32), entirely in memory. NoData (NaN)
+    is masked once: only valid cells are clamped, normalized and quantized, and NoData
+    (NODATA_U8 or NaN) is restored in the output. Blocks without voids skip the mask.
+    """
+    valid = ~np.isnan(tpi_arr)
+    n_valid = np.count_nonzero(valid)
+    all_valid = n_valid == valid.size
+    values = tpi_arr if all_valid else tpi_arr[valid]
+    if n_valid:
+        values = normalize_block(values, lower_limit, upper_limit, k, b)
+    if output_uint8:
+        values = quantize_u8(values)
+    if all_valid:
+        return values
+    out = np.full(tpi_arr.shape, NODATA_U8 if output_uint8 else np.nan, dtype=values.dtype)
+    out[valid] = values
+    return out
+
+
+def pass3_block(args):
+    """
+    Pass 3: read one block, process it in memory and save the result as a tile. Returns
+    the tile path, or (normalized, TPI, clamped) tile paths with keep_intermediate.
+    """
+    i, blk, lower_limit, upper_limit, k, b, from_memmap = args
+    r0, c0 = blk[0], blk[1]
+    t = tpi_block(*blk, cached=from_memmap)
+    if keep_intermediate:
+        # saved before process_tile, which normalizes t in place
+        tpi_tile = save_tile(t, r0, c0, i, "tpi")
+        clamp_tile = save_tile(np.clip(t, lower_limit, upper_limit), r0, c0, i, "tpi_clamp")
+    out = save_tile(process_tile(t, lower_limit, upper_limit, k, b), r0, c0, i, "tpi_norm")
+    return (out, tpi_tile, clamp_tile) if keep_intermediate else out
+
+
+def init_worker(worker_run_dir):
+    """
+    Pool initializer: use this run's folder, with a private tile folder that is also the
+    worker's scratch workspace, and share the cores between workers instead of each
+    Numba/numexpr kernel claiming all of them.
+    """
+    global tile_dir
+    set_run_dir(worker_run_dir)
+    tile_dir = tempfile.mkdtemp(prefix="worker_", dir=worker_run_dir)
+    arcpy.env.scratchWorkspace = tile_dir
+    n_threads = max(1, (os.cpu_count() or 1) // max_workers)
+    if numba is not None:
+        numba.set_num_threads(n_threads)
+    if numexpr is not None:
+        numexpr.set_num_threads(n_threads)
+
+
+def run_blocks(func, items):
+    """Map func over items, in a process pool when max_workers > 1 (results in order)."""
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(run_dir,)) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
 
-# === Step 1: DEM - Local Mean ===
-# Calculate the Topographic Position Index (TPI) by subtracting the focal mean
-# (local mean elevation) from the DEM. This enhances relative elevation differences,
-# highlighting convex and concave landforms at the specified scale.
-tpi = arcpy.sa.Raster(dem) - arcpy.sa.Raster(local_mean)
-tpi.save(tpi_raster)
+def run():
+    """Steps 1-3 over all blocks; scratch files go to run_dir."""
+    blocks = list(tile_iter())
+    print(f"Processing {len(blocks)} blocks with {max_workers} worker(s)")
 
-# Force a fresh re-load from disk (often helpful in FGDB workflows)
-tpi = arcpy.sa.Raster(tpi_raster)
+    # === Step 1: DEM - Local Mean ===
+    # Calculate the Topographic Position Index (TPI) by subtracting the focal mean
+    # (local mean elevation) from the DEM. This enhances relative elevation differences,
+    # highlighting convex and concave landforms at the specified scale.
+    stats_path = stats_cache_path() if use_stats_cache else None
+    stats_cached = stats_path is not None and os.path.exists(stats_path)
+    from_memmap = use_memmap and not stats_cached   # the scratch file is only written by pass 1
+    if stats_cached:
+        print(f"Loading cached TPI statistics: {stats_path}")
+        with np.load(stats_path) as cached:
+            acc = (int(cached["n_valid"]), float(cached["mean"]), float(cached["M2"]))
+            n_lo, n_hi = int(cached["n_lo"]), int(cached["n_hi"])
+            tail_sum, tail_sq = float(cached["tail_sum"]), float(cached["tail_sq"])
+    else:
+        # Pass 1: TPI mean/std (and the TPI scratch memmap for passes 2 and 3)
+        if from_memmap:
+            mm = open_tpi_scratch("w+")   # creates the scratch file at full size
+            del mm
+        acc = (0, 0.0, 0.0)
+        block_ranges = []   # per-block (min, max), used to skip blocks in pass 2
+        for moments, vmin, vmax in run_blocks(pass1_block, blocks):
+            acc = merge_moments(acc, moments)
+            block_ranges.append((vmin, vmax))
+    mean, stddev = population_stats(acc)
 
-# === Step 2: Clamp to ±2 SD ===
-# This step truncates extreme outlier values by clamping the TPI raster
-# to within two standard deviations (±2σ) of its mean.
-mean = float(arcpy.management.GetRasterProperties(tpi, "MEAN").getOutput(0))
-stddev = float(arcpy.management.GetRasterProperties(tpi, "STD").getOutput(0))
+    # === Step 2: Clamp to ±2 SD ===
+    # This step truncates extreme outlier values by clamping the TPI raster
+    # to within two standard deviations (±2σ) of its mean.
+    lower_limit = mean - 2 * stddev
+    upper_limit = mean + 2 * stddev
 
-lower_limit = mean - 2 * stddev
-upper_limit = mean + 2 * stddev
+    # Pass 2: mean/std of the clamped TPI (needed by Step 3), from the tails only.
+    # Clamping moves only the cells outside the limits, so the Pass 1 moments (centred
+    # on the mean) are corrected by those cells' deviations; cells inside need no work.
+    if not stats_cached:
+        n_lo = n_hi = 0
+        tail_sum, tail_sq = 0.0, 0.0   # sum and sum of squares of (value - mean) over the tails
+        # Only blocks whose TPI range reaches past a limit have tail cells; the rest are skipped
+        tail_blocks = [blk for blk, (vmin, vmax) in zip(blocks, block_ranges)
+                       if vmin < lower_limit or vmax > upper_limit]
+        for nl, nh, ts, tq in run_blocks(pass2_block,
+                                         [(blk, mean, lower_limit, upper_limit) for blk in tail_blocks]):
+            n_lo += nl
+            n_hi += nh
+            tail_sum += ts
+            tail_sq += tq
+        if stats_path:
+            np.savez(stats_path, n_valid=acc[0], mean=acc[1], M2=acc[2],
+                     n_lo=n_lo, n_hi=n_hi, tail_sum=tail_sum, tail_sq=tail_sq)
 
-tpi_clamped = arcpy.sa.Con(
-    tpi < lower_limit, lower_limit,
-    arcpy.sa.Con(tpi > upper_limit, upper_limit, tpi)
-)
-tpi_clamped.save(clamped_raster)
+    # === Step 3: Normalize to 0–255 using ±2σ centered transformation ===
+    # This formula maps -2σ to 0, +2σ to 255, and 0 (mean) to ~127.5
+    # Formula: ((value - mean) / (2 * stddev)) * 127.5 + 127.5
+    n_valid, _, M2 = acc
+    two_sd = 2 * stddev
+    # Clamped values sit at -2σ / +2σ from the mean; all other deviations are unchanged
+    dev_sum = -tail_sum - two_sd * n_lo + two_sd * n_hi
+    dev_sq = M2 - tail_sq + two_sd * two_sd * (n_lo + n_hi)
+    mean_val = mean + dev_sum / n_valid
+    stddev_val = math.sqrt(max(dev_sq - dev_sum * dev_sum / n_valid, 0.0) / n_valid)
 
-# Re-load clamped raster
-tpi_clamped = arcpy.sa.Raster(clamped_raster)
+    # Pass 3: clamp + normalize each block and save the normalized raster
+    # (8-bit by default: the 0–255 range needs no float, and the output is 4x smaller)
+    k = 127.5 / (2 * stddev_val)   # Step 3 formula as value * k + b
+    b = 127.5 - mean_val * k
+    tile_paths = run_blocks(pass3_block, [(i, blk, lower_limit, upper_limit, k, b,
+                                           from_memmap) for i, blk in enumerate(blocks)])
+    if keep_intermediate:
+        tile_paths, tpi_tiles, clamp_tiles = (list(paths) for paths in zip(*tile_paths))
+        write_output(tpi_tiles, tpi_raster, "32_BIT_FLOAT")
+        write_output(clamp_tiles, clamped_raster, "32_BIT_FLOAT")
+        print(f"✅ Saved TPI and clamped TPI rasters: {tpi_raster}, {clamped_raster}")
+    write_output(tile_paths, normalized_raster,
+                 "8_BIT_UNSIGNED" if output_uint8 else "32_BIT_FLOAT")
 
-# === Step 3: Normalize to 0–255 using ±2σ centered transformation ===
-# This formula maps -2σ to 0, +2σ to 255, and 0 (mean) to ~127.5
-# Formula: ((value - mean) / (2 * stddev)) * 127.5 + 127.5
-mean_val = float(arcpy.management.GetRasterProperties(tpi_clamped, "MEAN").getOutput(0))
-stddev_val = float(arcpy.management.GetRasterProperties(tpi_clamped, "STD").getOutput(0))
+    print(f"✅ Finished normalized raster ({'8-bit' if output_uint8 else 'float'}): {normalized_raster}")
 
-normalized = ((tpi_clamped - mean_val) / (2 * stddev_val)) * 127.5 + 127.5
 
-# Save the normalized float raster
-normalized.save(normalized_raster)
+def main():
+    set_run_dir(tempfile.mkdtemp(prefix=f"tpi_{variant_name}_", dir=arcpy.env.scratchFolder))
+    try:
+        run()
+    finally:
+        # TPI scratch file, leftover tiles and the COG mosaic, whether or not the run succeeded
+        shutil.rmtree(run_dir, ignore_errors=True)
 
-# Re-load normalized raster if needed
-normalized = arcpy.sa.Raster(normalized_raster)
 
-print(f"✅ Finished normalized raster (float): {normalized_raster}")
+# Guard required: worker processes re-import this module on Windows (spawn start method)
+if __name__ == "__main__":
+    main()
 
 # -----------------------------------------------------------------------------
 # Usage (example):
 # 1) Set 'dem', 'local_mean', and 'output_gdb' to your own paths.
 # 2) Optionally change 'variant_name' to reflect your scale (e.g., '50m').
 # 3) Run in the ArcGIS Pro Python environment (arcpy required).
-# 4) Outputs will be written into your 'output_gdb'.
+# 4) Outputs will be written into your 'output_gdb' (or 'output_folder' when
+#    output_format = "COG"); set keep_intermediate = True to also save the TPI and
+#    clamped TPI.
 # -----------------------------------------------------------------------------
\ No newline at end of file